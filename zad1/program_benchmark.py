@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+"""
+Compares building clingo program with one Control.add call per fact against ProgramBuilder,
+which passes the whole program to clingo at once. Empty boards are used, so every cell keeps all candidates.
+"""
+import argparse
+import time
+
+import sudoku_solver
+
+
+def add_per_fact(candidates, size):
+    cc = sudoku_solver.setup_clingo()
+    sudoku_solver.add_candidates(cc, candidates, size)
+    sudoku_solver.add_main_clingo_program(cc, size)
+    return cc
+
+
+def add_with_builder(candidates, size):
+    cc = sudoku_solver.setup_clingo()
+    builder = sudoku_solver.ProgramBuilder()
+    sudoku_solver.add_candidates(builder, candidates, size)
+    sudoku_solver.add_main_clingo_program(builder, size)
+    builder.flush(cc)
+    return cc
+
+
+def measure(build, candidates, size, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        build(candidates, size)
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs='*', default=[9, 16, 25])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        candidates = [(1 << size) - 1] * (size * size)
+        per_fact = measure(add_per_fact, candidates, size, args.repeat)
+        builder = measure(add_with_builder, candidates, size, args.repeat)
+        print('{size}x{size}: per fact {per_fact:.2f}ms, builder {builder:.2f}ms, speedup {speedup:.1f}x'.format(
+            size=size, per_fact=per_fact * 1000, builder=builder * 1000, speedup=per_fact / builder
+        ))
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+"""
+Packed sudoku format: 8 byte header (magic, board size, padding) followed by boards
+stored one after another, every cell as a single uint8 number (0 for empty cell), row by row.
+"""
+import argparse
+import os
+
+import numpy as np
+
+import sudoku_solver
+
+MAGIC = b'SDKP'
+HEADER_SIZE = 8
+
+
+def _header(size):
+    return MAGIC + bytes([size]) + bytes(HEADER_SIZE - len(MAGIC) - 1)
+
+
+def read_size(path):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE or not header.startswith(MAGIC):
+        raise ValueError('{} is not a packed sudoku file'.format(path))
+    return header[len(MAGIC)]
+
+
+def read_packed(path):
+    """
+    Maps packed file into memory. Returns read only array of shape (boards, size, size),
+    indexing it gives zero-copy views of single boards.
+    """
+    size = read_size(path)
+    count = (os.path.getsize(path) - HEADER_SIZE) // (size * size)
+    if count == 0:
+        return np.zeros((0, size, size), dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER_SIZE, shape=(count, size, size))
+
+
+def write_packed(path, boards, size=None):
+    boards = np.asarray(boards, dtype=np.uint8)
+    with open(path, 'wb') as f:
+        f.write(_header(size or boards.shape[-1]))
+        f.write(boards.tobytes())
+
+
+def append_packed(path, boards):
+    boards = np.asarray(boards, dtype=np.uint8)
+    if not os.path.exists(path):
+        write_packed(path, boards)
+        return
+    if read_size(path) != boards.shape[-1]:
+        raise ValueError('Cannot append boards of size {} to {}'.format(boards.shape[-1], path))
+    with open(path, 'ab') as f:
+        f.write(boards.tobytes())
+
+
+def board_to_numbers(board):
+    return [[0 if value is None else sudoku_solver.value_to_number(value) for value in row] for row in board]
+
+
+def numbers_to_board(numbers):
+    return [[sudoku_solver.number_to_value(n) if n else None for n in row] for row in numbers.tolist()]
+
+
+def pack(input_dir, output_path):
+    boards = []
+    for name in sorted(os.listdir(input_dir)):
+        board, size = sudoku_solver.read_file(os.path.join(input_dir, name))
+        if boards and len(boards[0]) != size:
+            raise ValueError('All puzzles in packed file must have the same size, {} differs'.format(name))
+        boards.append(board_to_numbers(board))
+    write_packed(output_path, boards)
+
+
+def unpack(input_path, output_dir):
+    boards = read_packed(input_path)
+    os.makedirs(output_dir, exist_ok=True)
+    for k, board in enumerate(boards):
+        with open(os.path.join(output_dir, '{}.txt'.format(k)), 'w') as f:
+            print(boards.shape[1], file=f)
+            for row in numbers_to_board(board):
+                print(*['0' if value is None else value for value in row], sep=' ', file=f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pack", help='directory with puzzles in text format')
+    parser.add_argument("--unpack", help='packed file')
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    if args.pack:
+        pack(args.pack, args.output)
+    if args.unpack:
+        unpack(args.unpack, args.output)
@@ -1,12 +1,15 @@
 #script (python)
 
+import json
 import os
+import resource
 import string
+import time
+from contextlib import contextmanager
+from itertools import islice
 
-import clingo
 
-
-def read_file(path, cc):
+def read_file(path):
     with open(path) as f:
         for i, line in enumerate(f):
             if i == 0:
@@ -16,15 +19,342 @@ def read_file(path, cc):
                 for j, elem in enumerate(line.strip().split(' ')):
                     if elem != '0':
                         board[i - 1][j] = elem.lower()
-                        comm = 'number({i}, {j}, {n}) .'.format(i=i - 1, j=j, n=elem.lower())
-                        cc.add('base', [], comm)
 
     return board, size
 
 
-def setup_clingo():
-    clingo_args = []
-    cc = clingo.Control(clingo_args)
+def value_to_number(value):
+    if value.isdigit():
+        return int(value)
+    return string.ascii_lowercase.index(value) + 10
+
+
+def number_to_value(number):
+    if number < 10:
+        return str(number)
+    return string.ascii_lowercase[number - 10]
+
+
+_UNITS = {}
+
+
+def get_units(size):
+    if size not in _UNITS:
+        sqrt_size = int(size ** 0.5)
+        rows = [[i * size + j for j in range(size)] for i in range(size)]
+        cols = [[i * size + j for i in range(size)] for j in range(size)]
+        boxes = [
+            [(i_shift * sqrt_size + i) * size + j_shift * sqrt_size + j
+             for i in range(sqrt_size) for j in range(sqrt_size)]
+            for i_shift in range(sqrt_size) for j_shift in range(sqrt_size)
+        ]
+        peers = [set() for _ in range(size * size)]
+        for unit in rows + cols + boxes:
+            for cell in unit:
+                peers[cell].update(unit)
+        for cell, cell_peers in enumerate(peers):
+            cell_peers.discard(cell)
+        _UNITS[size] = rows, cols, boxes, [tuple(p) for p in peers]
+    return _UNITS[size]
+
+
+def _naked_singles(candidates, peers, done):
+    changed = False
+    for cell, mask in enumerate(candidates):
+        if done[cell] or mask & (mask - 1):
+            continue
+        done[cell] = True
+        for peer in peers[cell]:
+            if candidates[peer] & mask:
+                candidates[peer] &= ~mask
+                changed = True
+    return changed
+
+
+def _hidden_singles(candidates, units, full):
+    changed = False
+    for unit in units:
+        seen = 0
+        twice = 0
+        for cell in unit:
+            twice |= seen & candidates[cell]
+            seen |= candidates[cell]
+        if seen != full:
+            return None
+        once = seen & ~twice
+        if not once:
+            continue
+        for cell in unit:
+            single = candidates[cell] & once
+            if single and candidates[cell] != single:
+                candidates[cell] = single
+                changed = True
+    return changed
+
+
+def _pointing_pairs(candidates, boxes, size):
+    sqrt_size = int(size ** 0.5)
+    changed = False
+    for box_num, box in enumerate(boxes):
+        top = box_num // sqrt_size * sqrt_size
+        left = box_num % sqrt_size * sqrt_size
+        row_masks = [0] * sqrt_size
+        col_masks = [0] * sqrt_size
+        for k, cell in enumerate(box):
+            row_masks[k // sqrt_size] |= candidates[cell]
+            col_masks[k % sqrt_size] |= candidates[cell]
+
+        for k in range(sqrt_size):
+            others = 0
+            for m in range(sqrt_size):
+                if m != k:
+                    others |= row_masks[m]
+            pointing = row_masks[k] & ~others
+            if pointing:
+                row_start = (top + k) * size
+                for j in range(size):
+                    if not left <= j < left + sqrt_size and candidates[row_start + j] & pointing:
+                        candidates[row_start + j] &= ~pointing
+                        changed = True
+
+            others = 0
+            for m in range(sqrt_size):
+                if m != k:
+                    others |= col_masks[m]
+            pointing = col_masks[k] & ~others
+            if pointing:
+                for i in range(size):
+                    if not top <= i < top + sqrt_size and candidates[i * size + left + k] & pointing:
+                        candidates[i * size + left + k] &= ~pointing
+                        changed = True
+    return changed
+
+
+def _reduce(candidates, done, size):
+    rows, cols, boxes, peers = get_units(size)
+    full = (1 << size) - 1
+    changed = True
+    while changed:
+        changed = _naked_singles(candidates, peers, done)
+        if not all(candidates):
+            return False
+
+        hidden = _hidden_singles(candidates, rows + cols + boxes, full)
+        if hidden is None:
+            return False
+        changed |= hidden
+
+        if not changed:
+            changed = _pointing_pairs(candidates, boxes, size)
+            if not all(candidates):
+                return False
+    return True
+
+
+def propagate(board, size):
+    """
+    Reduces candidates of every cell with naked singles, hidden singles and pointing pairs.
+    Candidates are bitmasks (bit n - 1 is set when n is possible), one per cell, row by row.
+    Returns None when the puzzle turns out to be unsatisfiable.
+    """
+    candidates = [(1 << size) - 1] * (size * size)
+    for i, row in enumerate(board):
+        for j, value in enumerate(row):
+            if value is not None:
+                candidates[i * size + j] = 1 << (value_to_number(value) - 1)
+
+    if not _reduce(candidates, [False] * (size * size), size):
+        return None
+    return candidates
+
+
+def is_solved(candidates):
+    return all(not mask & (mask - 1) for mask in candidates)
+
+
+def candidates_to_board(candidates, size):
+    return [
+        [number_to_value(candidates[i * size + j].bit_length()) for j in range(size)]
+        for i in range(size)
+    ]
+
+
+def candidate_values(mask):
+    number = 1
+    while mask:
+        if mask & 1:
+            yield number_to_value(number)
+        mask >>= 1
+        number += 1
+
+
+def add_candidates(cc, candidates, size):
+    for cell, mask in enumerate(candidates):
+        for value in candidate_values(mask):
+            cc.add('base', [], 'cand({}, {}, {}) .'.format(cell // size, cell % size, value))
+
+
+class SearchLimitReached(Exception):
+    pass
+
+
+def _most_constrained_cell(candidates):
+    best_cell = None
+    best_count = None
+    for cell, mask in enumerate(candidates):
+        if mask & (mask - 1):
+            count = bin(mask).count('1')
+            if best_count is None or count < best_count:
+                best_cell, best_count = cell, count
+                if count == 2:
+                    break
+    return best_cell
+
+
+def iter_native_solutions(candidates, size, max_nodes=None):
+    """
+    Depth first search over candidate bitmasks, branching on the cell with the fewest candidates
+    and propagating after every guess. Lazily yields solved boards.
+    Raises SearchLimitReached after max_nodes branchings.
+    """
+    stack = [(candidates[:], [False] * (size * size))]
+    nodes = 0
+    while stack:
+        candidates, done = stack.pop()
+        if not _reduce(candidates, done, size):
+            continue
+
+        cell = _most_constrained_cell(candidates)
+        if cell is None:
+            yield candidates_to_board(candidates, size)
+            continue
+
+        nodes += 1
+        if max_nodes is not None and nodes > max_nodes:
+            raise SearchLimitReached('Native search gave up after {} nodes'.format(max_nodes))
+
+        mask = candidates[cell]
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            child = candidates[:]
+            child[cell] = bit
+            stack.append((child, done[:]))
+
+
+def solve_native(candidates, size, max_nodes=None):
+    return next(iter_native_solutions(candidates, size, max_nodes), None)
+
+
+BACKENDS = ('auto', 'native', 'clingo')
+NATIVE_MAX_SIZE = 16
+NATIVE_MAX_NODES = 200
+
+
+def get_backend():
+    backend = os.environ.get('SUDOKU_BACKEND', 'auto')
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend {}, expected one of: {}'.format(backend, ', '.join(BACKENDS)))
+    return backend
+
+
+def solve_with_backend(candidates, size, backend, models=1):
+    """
+    Runs native engine when the backend allows it and returns up to models solutions.
+    In 'auto' mode large or hard puzzles raise SearchLimitReached, so caller should fall back to clingo.
+    """
+    if backend == 'native':
+        return list(islice(iter_native_solutions(candidates, size), models))
+    if backend == 'auto' and size <= NATIVE_MAX_SIZE:
+        return list(islice(iter_native_solutions(candidates, size, NATIVE_MAX_NODES), models))
+    raise SearchLimitReached('Puzzle is left to clingo')
+
+
+class Stats:
+    """
+    Optional instrumentation of the solving pipeline. For every puzzle records time spent in each phase,
+    clingo statistics and growth of peak memory of the process while solving it, and appends them as a JSON line
+    to output_path.
+    Without output_path nothing is recorded.
+    """
+
+    def __init__(self, output_path=None):
+        self.output = open(output_path, 'a') if output_path else None
+        self.record = None
+        self.start_max_rss = 0
+
+    @property
+    def clingo_args(self):
+        return ['--stats'] if self.output else []
+
+    def start(self, puzzle):
+        if self.output:
+            self.record = {'puzzle': puzzle, 'phases': {}}
+            self.start_max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    @contextmanager
+    def phase(self, name):
+        if self.record is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases = self.record['phases']
+            phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
+    def add_clingo_statistics(self, cc):
+        if self.record is None:
+            return
+        statistics = cc.statistics
+        self.record['clingo'] = {
+            'choices': statistics['solving']['solvers']['choices'],
+            'conflicts': statistics['solving']['solvers']['conflicts'],
+            'rules': statistics['problem']['lp']['rules'],
+            'atoms': statistics['problem']['lp']['atoms'],
+        }
+
+    def finish(self, result):
+        if self.record is None:
+            return
+        self.record['result'] = result
+        # ru_maxrss is the peak of the whole process, so only its growth belongs to this puzzle
+        self.record['max_rss_growth_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - self.start_max_rss
+        print(json.dumps(self.record), file=self.output)
+        self.record = None
+
+    def close(self):
+        if self.output:
+            self.output.close()
+
+
+NO_STATS = Stats()
+
+
+class ProgramBuilder:
+    """
+    Collects program parts with the same interface as clingo.Control.add and passes them to clingo
+    at once, so the whole program goes through the parser in a single call instead of one per fact.
+    """
+
+    def __init__(self):
+        self.parts = {}
+
+    def add(self, name, parameters, program):
+        self.parts.setdefault((name, tuple(parameters)), []).append(program)
+
+    def flush(self, cc):
+        for (name, parameters), parts in self.parts.items():
+            cc.add(name, list(parameters), '\n'.join(parts))
+        self.parts = {}
+
+
+def setup_clingo(clingo_args=()):
+    # imported lazily, puzzles solved natively do not pay for loading clingo
+    import clingo
+
+    cc = clingo.Control(list(clingo_args))
     return cc
 
 
@@ -32,41 +362,30 @@ def add_main_clingo_program(cc, size):
     size_sqrt = int(size ** 0.5)
 
     cc.add('base', [], '''
-    #const size = %d.
-
-    %% every cell has unique number
-    1 { number(I, J, N) : num(N)} 1 :- row(I), col(J) .
-    
-    %% every column is filled
-    size { number(I, J, N): num(N), row(I) } size :- col(J) .
-    
-    %% every row is filled
-    size { number(I, J, N): num(N), col(J) } size :- row(I) .
-
-    %% numbers are unique in rows
+    % every cell has unique number from its candidates
+    1 { number(I, J, N) : cand(I, J, N) } 1 :- row(I), col(J) .
+
+    % numbers are unique in rows
     1 {number(I, J, N) : col(J)} 1 :- row(I), num(N) .
-    
-    %% numbers are unique in columns
+
+    % numbers are unique in columns
     1 {number(I, J, N) : row(I)} 1 :- col(J), num(N) .
-    
-    %% numbers are unique in boxes
-    :- number(I1, J1, N), 
-       number(I2, J2, N),
-       I1 / %d == I2 / %d,
-       J1 / %d == J2 / %d,
-       |I2 - I1| + |J2 - J1| > 0 .
-       
-    ''' % tuple([size] + [size_sqrt] * 4))
+
+    % numbers are unique in boxes
+    1 {number(I, J, N) : box(B, I, J)} 1 :- box(B, _, _), num(N) .
+    ''')
 
     for i in range(size):
-        if i < 9:
-            num = i + 1
-        else:
-            num = string.ascii_lowercase[i - 9]
+        num = number_to_value(i + 1)
         cc.add('base', [], 'num({}) .'.format(num))
         cc.add('base', [], 'row({}) .'.format(i))
         cc.add('base', [], 'col({}) .'.format(i))
 
+    for i in range(size):
+        for j in range(size):
+            box = i // size_sqrt * size_sqrt + j // size_sqrt
+            cc.add('base', [], 'box({}, {}, {}) .'.format(box, i, j))
+
 
 def print_on_screen(board, sqrt_size):
     for i, row in enumerate(board):
@@ -101,31 +420,263 @@ def update_solution(model, board):
 
 
 def run():
-    cc = setup_clingo()
-
     path = os.environ['SUDOKU_PATH']
     output_path = os.environ.get('OUTPUT_PATH')
-    board, size = read_file(path, cc)
+    stats = Stats(os.environ.get('SUDOKU_STATS'))
+
+    stats.start(path)
+    result = solve_file(path, output_path, stats)
+    stats.finish(result)
+    stats.close()
+
+
+def solve_file(path, output_path, stats=NO_STATS):
+    with stats.phase('parse'):
+        board, size = read_file(path)
     sqrt_size = int(size ** 0.5)
 
-    add_main_clingo_program(cc, size)
+    if os.environ.get('SUDOKU_MODE') == 'unique':
+        verdict = check_uniqueness(board, size, get_backend(), stats=stats)
+        print('Result:', verdict)
+        return verdict
 
-    cc.ground([("base", [])])
+    def on_solution(solution):
+        print('Result: SATISFIABLE')
+        print_on_screen(solution, sqrt_size)
+        save_to_file(size, solution, output_path)
+
+    with stats.phase('propagate'):
+        candidates = propagate(board, size)
+    if candidates is None:
+        print('Result: UNSATISFIABLE')
+        return 'UNSATISFIABLE'
+    if is_solved(candidates):
+        on_solution(candidates_to_board(candidates, size))
+        return 'SATISFIABLE'
+
+    try:
+        with stats.phase('native'):
+            solutions = solve_with_backend(candidates, size, get_backend())
+    except SearchLimitReached:
+        pass
+    else:
+        if solutions:
+            on_solution(solutions[0])
+            return 'SATISFIABLE'
+        print('Result: UNSATISFIABLE')
+        return 'UNSATISFIABLE'
+
+    cc = setup_clingo(stats.clingo_args)
+    with stats.phase('add'):
+        builder = ProgramBuilder()
+        add_candidates(builder, candidates, size)
+        add_main_clingo_program(builder, size)
+        builder.flush(cc)
+
+    with stats.phase('ground'):
+        cc.ground([("base", [])])
 
     def on_model(m):
-        print('Result: SATISFIABLE')
-        update_solution(m, board)
-        print_on_screen(board, sqrt_size)
-        save_to_file(size, board, output_path)
+        with stats.phase('on_model'):
+            update_solution(m, board)
+            on_solution(board)
 
-    res = cc.solve(on_model=on_model)
+    with stats.phase('solve'):
+        res = cc.solve(on_model=on_model)
+    stats.add_clingo_statistics(cc)
     if res.unsatisfiable:
         print('Result: UNSATISFIABLE')
+        return 'UNSATISFIABLE'
+    return 'SATISFIABLE'
+
+
+def candidate_literals(cc, size):
+    literals = [None] * (size * size * size)
+    for atom in cc.symbolic_atoms.by_signature('cand', 3):
+        i, j, value = atom.symbol.arguments
+        cell = i.number * size + j.number
+        literals[cell * size + value_to_number(str(value)) - 1] = atom.literal
+    return literals
+
+
+def setup_batch_clingo(size, clingo_args=()):
+    cc = setup_clingo(clingo_args)
+    builder = ProgramBuilder()
+    add_main_clingo_program(builder, size)
+
+    builder.add('base', [], '''
+    % candidates of the current puzzle are switched on from python
+    #external cand(I, J, N) : row(I), col(J), num(N) .
+    ''')
+    builder.flush(cc)
+
+    cc.ground([("base", [])])
+    return cc
+
+
+def solve_candidates(cc, literals, candidates, size, models=1, stats=NO_STATS):
+    with stats.phase('assign'):
+        assigned = [
+            literals[cell * size + value_to_number(value) - 1]
+            for cell, mask in enumerate(candidates)
+            for value in candidate_values(mask)
+        ]
+        for literal in assigned:
+            cc.assign_external(literal, True)
+
+    solutions = []
+    cc.configuration.solve.models = models
+    try:
+        with stats.phase('solve'), cc.solve(yield_=True) as handle:
+            for m in handle:
+                with stats.phase('on_model'):
+                    solution = [[None] * size for _ in range(size)]
+                    update_solution(m, solution)
+                solutions.append(solution)
+    finally:
+        with stats.phase('assign'):
+            for literal in assigned:
+                cc.assign_external(literal, False)
+    stats.add_clingo_statistics(cc)
+    return solutions
+
+
+def find_solutions(board, size, models=1, backend='auto', controls=None, stats=NO_STATS):
+    """
+    Finds up to models solutions of a single puzzle in process. Clingo programs grounded in batch mode
+    are cached per board size in controls, so passing the same dict reuses them between puzzles.
+    """
+    with stats.phase('propagate'):
+        candidates = propagate(board, size)
+    if candidates is None:
+        return []
+    if is_solved(candidates):
+        return [candidates_to_board(candidates, size)]
+    try:
+        with stats.phase('native'):
+            return solve_with_backend(candidates, size, backend, models)
+    except SearchLimitReached:
+        pass
+
+    if controls is None:
+        controls = {}
+    if size not in controls:
+        with stats.phase('ground'):
+            cc = setup_batch_clingo(size, stats.clingo_args)
+            controls[size] = cc, candidate_literals(cc, size)
+    cc, literals = controls[size]
+    return solve_candidates(cc, literals, candidates, size, models, stats)
+
+
+def solve_board(board, size, backend='auto', controls=None, stats=NO_STATS):
+    solutions = find_solutions(board, size, 1, backend, controls, stats)
+    return solutions[0] if solutions else None
+
+
+UNIQUENESS_VERDICTS = ('UNSATISFIABLE', 'UNIQUE', 'MULTIPLE')
+
+
+def check_uniqueness(board, size, backend='auto', controls=None, stats=NO_STATS):
+    """
+    Stops search on the second solution, returns 'UNSATISFIABLE', 'UNIQUE' or 'MULTIPLE'.
+    """
+    solutions = find_solutions(board, size, 2, backend, controls, stats)
+    return UNIQUENESS_VERDICTS[len(solutions)]
+
+
+def solve_batch(paths, backend='auto', stats=NO_STATS):
+    controls = {}
+    for path in paths:
+        stats.start(path)
+        with stats.phase('parse'):
+            board, size = read_file(path)
+        solution = solve_board(board, size, backend, controls, stats)
+        stats.finish('UNSATISFIABLE' if solution is None else 'SATISFIABLE')
+        yield path, size, solution
+
+
+def check_uniqueness_batch(paths, backend='auto', stats=NO_STATS):
+    controls = {}
+    for path in paths:
+        stats.start(path)
+        with stats.phase('parse'):
+            board, size = read_file(path)
+        verdict = check_uniqueness(board, size, backend, controls, stats)
+        stats.finish(verdict)
+        yield path, verdict
+
+
+def run_batch():
+    input_dir = os.environ['SUDOKU_DIR']
+    output_dir = os.environ.get('OUTPUT_DIR')
+    paths = [os.path.join(input_dir, name) for name in sorted(os.listdir(input_dir))]
+    stats = Stats(os.environ.get('SUDOKU_STATS'))
+
+    if os.environ.get('SUDOKU_MODE') == 'unique':
+        for path, verdict in check_uniqueness_batch(paths, get_backend(), stats):
+            print(path, 'Result:', verdict)
+        stats.close()
+        return
+
+    for path, size, solution in solve_batch(paths, get_backend(), stats):
+        if solution is None:
+            print(path, 'Result: UNSATISFIABLE')
+            continue
+        print(path, 'Result: SATISFIABLE')
+        if output_dir:
+            save_to_file(size, solution, os.path.join(output_dir, os.path.basename(path)))
+    stats.close()
+
+
+PACKED_CHUNK = 4096
+
+
+def run_packed_batch():
+    # packed format needs numpy, so it is imported only when used
+    import numpy as np
+    import sudoku_packed
+
+    puzzles = sudoku_packed.read_packed(os.environ['SUDOKU_PACKED'])
+    output_path = os.environ.get('OUTPUT_PACKED')
+    size = puzzles.shape[1]
+    backend = get_backend()
+    controls = {}
+    stats = Stats(os.environ.get('SUDOKU_STATS'))
+
+    if output_path:
+        sudoku_packed.write_packed(output_path, [], size)
+    solutions = np.zeros((PACKED_CHUNK, size, size), dtype=np.uint8)
+    filled = 0
+    for k, puzzle in enumerate(puzzles):
+        stats.start(k)
+        with stats.phase('parse'):
+            board = sudoku_packed.numbers_to_board(puzzle)
+        solution = solve_board(board, size, backend, controls, stats)
+        stats.finish('UNSATISFIABLE' if solution is None else 'SATISFIABLE')
+        if solution is None:
+            print(k, 'Result: UNSATISFIABLE')
+            solutions[filled] = 0
+        else:
+            print(k, 'Result: SATISFIABLE')
+            solutions[filled] = sudoku_packed.board_to_numbers(solution)
+        filled += 1
+        if filled == PACKED_CHUNK:
+            if output_path:
+                sudoku_packed.append_packed(output_path, solutions)
+            filled = 0
+    if filled and output_path:
+        sudoku_packed.append_packed(output_path, solutions[:filled])
+    stats.close()
 
 
 if __name__ == '__main__':
     print('\n===== PYTHON RUN STARTS HERE =====\n')
-    run()
+    if 'SUDOKU_PACKED' in os.environ:
+        run_packed_batch()
+    elif 'SUDOKU_DIR' in os.environ:
+        run_batch()
+    else:
+        run()
     print('\n====== PYTHON RUN ENDS HERE ======\n')
 
 #end.
@@ -1,88 +1,140 @@
 #!/usr/bin/python3
+import argparse
+import json
 import os
-import subprocess
-from tempfile import NamedTemporaryFile
-
-
-def read_file(path):
-    with open(path) as f:
-        for k, line in enumerate(f):
-            if k == 0:
-                size = int(line.strip().split(' ')[0])
-                board = [[None] * size for _ in range(size)]
-            else:
-                gen = iter(line.strip().split(' '))
-
-                for i in range(size):
-                    for j in range(size):
-                        board[i][j] = next(gen)
-    return board, size
-
-
-def check(solution, size, sqrt_size):
-    for row in solution:
-        if len(set(row)) != size:
-            print("Not valid solution in row", row)
-            raise AssertionError
-    cols = [[solution[i][j] for i in range(size)] for j in range(size)]
-
-    for col in cols:
-        if len(set(col)) != size:
-            print("Not valid solution in column", col)
-            raise AssertionError
-
-    boxes = [
-        [solution[i + i_shift * sqrt_size][j + j_shift * sqrt_size] for j in range(sqrt_size) for i in range(sqrt_size)]
-        for i_shift in range(sqrt_size) for j_shift in range(sqrt_size)
-    ]
-    for box in boxes:
-        if len(set(box)) != size:
-            print("Not valid solution in box", box)
-            raise AssertionError
+import sys
+import time
+from collections import namedtuple
+from multiprocessing import Pool
+
+import numpy as np
+
+import sudoku_packed
+import sudoku_solver
+
+
+def boards_to_array(boards):
+    return np.array([
+        [[sudoku_solver.value_to_number(value) for value in row] for row in board]
+        for board in boards
+    ], dtype=np.int32)
+
+
+def check_batch(solutions):
+    """
+    Validates stacked solutions of shape (batch, size, size) holding numbers 1..size at once.
+    Returns dict from index of every invalid solution to list of its broken units, f.e. ('box', 4).
+    """
+    batch, size, _ = solutions.shape
+    sqrt_size = int(size ** 0.5)
+    boxes = solutions.reshape(batch, sqrt_size, sqrt_size, sqrt_size, sqrt_size) \
+        .transpose(0, 1, 3, 2, 4) \
+        .reshape(batch, size, size)
+    expected = np.arange(1, size + 1)
+
+    failures = {}
+    for unit_name, units in (('row', solutions), ('column', solutions.transpose(0, 2, 1)), ('box', boxes)):
+        broken = (np.sort(units, axis=2) != expected).any(axis=2)
+        for puzzle, unit in zip(*np.nonzero(broken)):
+            failures.setdefault(int(puzzle), []).append((unit_name, int(unit)))
+    return failures
+
+
+TestResult = namedtuple('TestResult', ['path', 'expected', 'result', 'valid', 'time', 'error'])
+
+# clingo programs grounded by a worker process, reused by all puzzles it solves
+_CONTROLS = {}
+# packed files mapped by a worker process
+_PACKED = {}
+
+
+def load_puzzle(path, index):
+    if index is None:
+        return sudoku_solver.read_file(path)
+    if path not in _PACKED:
+        _PACKED[path] = sudoku_packed.read_packed(path)
+    puzzle = _PACKED[path][index]
+    return sudoku_packed.numbers_to_board(puzzle), len(puzzle)
+
+
+def run_test(job):
+    path, index, expected, backend = job
+    name = path if index is None else '{}[{}]'.format(path, index)
+    start = time.perf_counter()
+    try:
+        board, size = load_puzzle(path, index)
+        solution = sudoku_solver.solve_board(board, size, backend, _CONTROLS)
+    except Exception as e:
+        return TestResult(name, expected, 'ERROR', False, time.perf_counter() - start, repr(e)), None
+    elapsed = time.perf_counter() - start
+
+    if solution is None:
+        return TestResult(name, expected, 'UNSATISFIABLE', expected == 'UNSATISFIABLE', elapsed, None), None
+    return TestResult(name, expected, 'SATISFIABLE', expected == 'SATISFIABLE', elapsed, None), solution
+
+
+def validate(outcomes):
+    results = [result for result, _ in outcomes]
+    by_size = {}
+    for k, (_, solution) in enumerate(outcomes):
+        if solution is not None:
+            by_size.setdefault(len(solution), []).append(k)
+
+    for indices in by_size.values():
+        failures = check_batch(boards_to_array(outcomes[k][1] for k in indices))
+        for puzzle, units in failures.items():
+            k = indices[puzzle]
+            error = 'Not valid solution in ' + ', '.join('{} {}'.format(*unit) for unit in units)
+            results[k] = results[k]._replace(valid=False, error=error)
+    return results
+
+
+def get_jobs(paths, expected, backend):
+    """
+    Every path is either directory with puzzles in text format or a packed file.
+    """
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            jobs.extend((os.path.join(path, file), None, expected, backend) for file in sorted(os.listdir(path)))
+        else:
+            jobs.extend((path, index, expected, backend) for index in range(len(sudoku_packed.read_packed(path))))
+    return jobs
+
+
+def run_tests(jobs, processes):
+    chunksize = max(1, len(jobs) // (4 * processes))
+    with Pool(processes) as pool:
+        return list(pool.imap_unordered(run_test, jobs, chunksize=chunksize))
 
 
 if __name__ == '__main__':
-    for file in os.listdir('examples/good'):
-        with NamedTemporaryFile() as temp_file:
-            try:
-                command = ('export SUDOKU_PATH="examples/good/{}" &&'
-                           'export OUTPUT_PATH={} &&'
-                           'clingo sudoku_solver.py > /dev/null').format(file, temp_file.name)
-                p = subprocess.run(command, shell=True)
-                """
-                enum ExitCode {
-                    E_UNKNOWN   = 0,  /*!< Satisfiablity of problem not knwon; search not started.    */
-                    E_INTERRUPT = 1,  /*!< Run was interrupted.                                       */
-                    E_SAT       = 10, /*!< At least one model was found.                              */
-                    E_EXHAUST   = 20, /*!< Search-space was completely examined.                      */
-                    E_MEMORY    = 33, /*!< Run was interrupted by out of memory exception.            */
-                    E_ERROR     = 65, /*!< Run was interrupted by internal error.                     */
-                    E_NO_RUN    = 128 /*!< Search not started because of syntax or command line error.*/
-                };       
-                30 =  E_SAT + E_EXHAUST
-                """
-                if p.returncode != 30:
-                    print("Command", command, "returned status", p.returncode)
-            except subprocess.CalledProcessError as e:
-                print(command)
-                raise
-            board, size = read_file(temp_file.name)
-            sqrt_size = int(size ** 0.5)
-            try:
-                check(board, size, sqrt_size)
-            except AssertionError:
-                print('Error in', file)
-                print(size, board)
-
-    for file in os.listdir('examples/bad'):
-        with NamedTemporaryFile() as temp_file:
-            command = ('export SUDOKU_PATH="examples/bad/{}" &&'
-                       'clingo sudoku_solver.py > {}').format(file, temp_file.name)
-            p = subprocess.run(command, shell=True)
-            if p.returncode != 30:
-                print("Command", command, "returned status", p.returncode)
-            with open(temp_file.name) as f:
-                output_lines = f.readlines()
-                if 'Result: UNSATISFIABLE\n' not in output_lines:
-                    print('Error in', file)
-                    print(output_lines)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--good", nargs='*', default=['examples/good'])
+    parser.add_argument("--bad", nargs='*', default=['examples/bad'])
+    parser.add_argument("--backend", choices=sudoku_solver.BACKENDS, default='auto')
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--report", help='file to write per puzzle results to, as JSON lines')
+    args = parser.parse_args()
+
+    jobs = get_jobs(args.good, 'SATISFIABLE', args.backend) + get_jobs(args.bad, 'UNSATISFIABLE', args.backend)
+
+    start = time.perf_counter()
+    results = validate(run_tests(jobs, args.processes))
+    elapsed = time.perf_counter() - start
+
+    results.sort(key=lambda r: r.path)
+    failed = [r for r in results if not r.valid]
+    for r in failed:
+        print('Error in', r.path, '- expected', r.expected, 'got', r.result, r.error or '')
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            for r in results:
+                print(json.dumps(r._asdict()), file=f)
+
+    summary = 'Solved {} puzzles in {:.2f}s with {} processes'.format(len(results), elapsed, args.processes)
+    if results:
+        summary += ' ({:.1f} puzzles/s, slowest {:.4f}s)'.format(len(results) / elapsed, max(r.time for r in results))
+    print('{}, {} failed'.format(summary, len(failed)))
+    sys.exit(1 if failed else 0)
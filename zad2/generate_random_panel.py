@@ -1,30 +1,13 @@
 import argparse
 import json
 import os
-import random
+from collections import namedtuple
 
+import numpy as np
 
-def get_panelists(n):
-    res = {}
-    for i in map(str, range(n)):
-        if random.random() < 0.5:
-            sex = 'm'
-        else:
-            sex = 'k'
-        age = random.randint(0, 74)
-
-        age_range = age // 5 * 5
-        age_value = '{}-{}'.format(age_range, age_range + 4)
-
-        res[i] = {
-            "demo": {
-                "sex": sex,
-                "age": age_value
-            },
-            "metric": abs(int(100 * random.paretovariate(1.5)))
-        }
-    return res
+import panel_stream
 
+Dimension = namedtuple('Dimension', ['name', 'values', 'panel_shares', 'population'])
 
 POLISH_POPULATION = {
     "age": {
@@ -49,27 +32,147 @@ POLISH_POPULATION = {
 }
 
 
-def run(population_file, panelists_file, number_of_panelists):
-    panelists = get_panelists(number_of_panelists)
+def polish_dimensions():
+    """
+    Age groups 0-74 and sex drawn uniformly, weighted to Polish population aged 15-74.
+    """
+    ages = ['{}-{}'.format(age, age + 4) for age in range(0, 75, 5)]
+    return [
+        Dimension('age', ages, np.full(len(ages), 1 / len(ages)), POLISH_POPULATION['age']),
+        Dimension('sex', ['m', 'k'], np.array([0.5, 0.5]), POLISH_POPULATION['sex']),
+    ]
+
+
+def _split_total(total, shares):
+    # largest remainder method, so populations of values sum up exactly to total
+    exact = total * shares
+    population = np.floor(exact).astype(np.int64)
+    population[np.argsort(population - exact)[:total - population.sum()]] += 1
+    return population
+
+
+def random_dimensions(cardinalities, total, rng):
+    """
+    Demographic features d0, d1, ... with given numbers of values. Population shares of values are random,
+    panel shares differ from them by up to 30%, like in a real, not representative panel.
+    """
+    dimensions = []
+    for i, cardinality in enumerate(cardinalities):
+        values = ['v{}'.format(k) for k in range(cardinality)]
+        shares = rng.dirichlet(np.full(cardinality, 5.0))
+        panel_shares = shares * rng.uniform(0.7, 1.3, cardinality)
+        population = _split_total(total, shares)
+        dimensions.append(Dimension(
+            'd{}'.format(i), values, panel_shares / panel_shares.sum(), dict(zip(values, population.tolist()))
+        ))
+    # columns of panel follow sorted names of demographic features
+    return sorted(dimensions, key=lambda dimension: dimension.name)
+
+
+def get_population(dimensions, total):
+    population = {dimension.name: dimension.population for dimension in dimensions}
+    population['total'] = total
+    return population
+
+
+def generate_chunks(n, dimensions, seed, chunk_size):
+    """
+    Yields ids, demographic codes and metric of panelists, chunk by chunk. Every column is drawn from
+    its own stream of uniform numbers, so generated panel does not depend on chunk size.
+    """
+    streams = [np.random.default_rng([seed, k]) for k in range(len(dimensions) + 1)]
+    cumulative_shares = [np.cumsum(dimension.panel_shares) for dimension in dimensions]
+    code_type = np.min_scalar_type(max(len(dimension.values) for dimension in dimensions))
+    for start in range(0, n, chunk_size):
+        size = min(chunk_size, n - start)
+        codes = np.empty((size, len(dimensions)), dtype=code_type)
+        for j, (stream, shares) in enumerate(zip(streams, cumulative_shares)):
+            codes[:, j] = np.minimum(np.searchsorted(shares, stream.random(size), side='right'), len(shares) - 1)
+        # Pareto distribution with shape 1.5 and scale 100, by inverse transform
+        metric = np.floor(100 * (1 - streams[-1].random(size)) ** (-1 / 1.5))
+        yield np.arange(start, start + size), codes, metric
+
+
+def _format_chunk(dimensions, ids, codes, metric, as_lines):
+    demo = np.full(len(ids), '{', dtype=object)
+    for j, dimension in enumerate(dimensions):
+        fragments = np.array([
+            '{}"{}": "{}"'.format(', ' if j else '', dimension.name, value) for value in dimension.values
+        ], dtype=object)
+        demo = demo + fragments[codes[:, j]]
+    ids = ids.astype(str).astype(object)
+    metric = metric.astype(np.int64).astype(str).astype(object)
+    if as_lines:
+        return '{"demo": ' + demo + '}, "id": "' + ids + '", "metric": ' + metric + '}'
+    return '    "' + ids + '": {"demo": ' + demo + '}, "metric": ' + metric + '}'
+
+
+def write_panel(path, n, dimensions, seed, chunk_size):
+    """
+    Writes panel as JSON Lines (.jsonl), JSON object (.json) or directory in columnar format (otherwise).
+    """
+    chunks = generate_chunks(n, dimensions, seed, chunk_size)
+    if not path.endswith(('.json', '.jsonl')):
+        writer = panel_stream.ColumnarWriter(
+            path, n, [dimension.name for dimension in dimensions], [dimension.values for dimension in dimensions]
+        )
+        for chunk in chunks:
+            writer.write(*chunk)
+        writer.close()
+        return
+
+    as_lines = path.endswith('.jsonl')
+    with open(path, 'w') as f:
+        if not as_lines:
+            f.write('{\n')
+        for k, chunk in enumerate(chunks):
+            if k and not as_lines:
+                f.write(',\n')
+            f.write(('\n' if as_lines else ',\n').join(_format_chunk(dimensions, *chunk, as_lines)))
+            if as_lines:
+                f.write('\n')
+        if not as_lines:
+            f.write('\n}\n')
+
+
+def run(population_file, panelists_file, number_of_panelists, cardinalities=None, total=None, seed=None,
+        chunk_size=10 ** 6):
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    if cardinalities:
+        dimensions = random_dimensions(cardinalities, total or 100 * number_of_panelists, np.random.default_rng(seed))
+        population = get_population(dimensions, total or 100 * number_of_panelists)
+    else:
+        dimensions = polish_dimensions()
+        population = POLISH_POPULATION
 
-    os.makedirs(os.path.dirname(panelists_file), exist_ok=True)
-    with open(panelists_file, 'w') as f:
-        json.dump(panelists, f, indent=4, sort_keys=True)
+    os.makedirs(os.path.dirname(os.path.abspath(panelists_file)), exist_ok=True)
+    write_panel(panelists_file, number_of_panelists, dimensions, seed, chunk_size)
 
-    os.makedirs(os.path.dirname(population_file), exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(population_file)), exist_ok=True)
     with open(population_file, 'w') as f:
-        json.dump(POLISH_POPULATION, f, indent=4, sort_keys=True)
+        json.dump(population, f, indent=4, sort_keys=True)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("--output-panelists")
+    parser.add_argument("--output-panelists",
+                        help='panelists JSON or JSON Lines (.jsonl) file, any other path is columnar panel directory')
     parser.add_argument("--number-of-panelists", type=int, default=1000)
     parser.add_argument("--output-population")
+    parser.add_argument("--dimensions", type=int, nargs='*',
+                        help='numbers of values of random demographic features, Polish age and sex by default')
+    parser.add_argument("--total", type=int, help='population total of random features, 100 per panelist by default')
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--chunk-size", type=int, default=10 ** 6)
     args = parser.parse_args()
 
     run(
         population_file=args.output_population,
         number_of_panelists=args.number_of_panelists,
-        panelists_file=args.output_panelists
+        panelists_file=args.output_panelists,
+        cardinalities=args.dimensions,
+        total=args.total,
+        seed=args.seed,
+        chunk_size=args.chunk_size
     )
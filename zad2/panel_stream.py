@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+"""
+Streaming panelists input and weights output. Panelists are read one by one, either from JSON Lines
+(one `{"id": ..., "demo": ..., "metric": ...}` object per line) or incrementally from the regular panelists
+JSON object, and folded into numbers of panelists in crosses and a compact array of cross indexes.
+Panels can be also kept in columnar format: a directory with `ids.npy`, `codes.npy` and `metric.npy` arrays
+and `demo.json` with names and values of demographic features, read as memory mapped weighting.Panel.
+"""
+import argparse
+import json
+import os
+import re
+from array import array
+
+import numpy as np
+
+import weighting
+
+CHUNK_SIZE = 1 << 16
+_WHITESPACE = re.compile(r'\s*')
+_DELIMITERS = ' \t\n\r,}]'
+
+
+def iter_json_object(f, chunk_size=CHUNK_SIZE):
+    """
+    Yields items of top level JSON object read from file in chunks, so only a single value is held in memory.
+    Only whitespace may follow the object.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    offset = 0
+    expected, key = '{', None
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos < len(buffer):
+            char = buffer[pos]
+            if expected == 'end':
+                raise ValueError('Unexpected data after panelists object at offset {}'.format(offset + pos))
+            if expected in ('{', ':') and char == expected:
+                pos += 1
+                expected = 'first key' if expected == '{' else 'value'
+                continue
+            if expected in ('first key', ',') and char == '}':
+                pos += 1
+                expected = 'end'
+                continue
+            if expected == ',' and char == ',':
+                pos += 1
+                expected = 'key'
+                continue
+            if expected not in ('first key', 'key', 'value'):
+                raise ValueError('Expected {!r} at offset {} of panelists file'.format(expected, offset + pos))
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                end = None
+            # value ending with the buffer may be truncated, unless it is the end of file, and number may be
+            # truncated anywhere (f.e. '727.' of '727.5'), unless a delimiter follows it
+            complete = end is not None and (end < len(buffer) or eof)
+            if complete and not eof and isinstance(value, (int, float)) and buffer[end] not in _DELIMITERS:
+                complete = False
+            if complete:
+                if expected != 'value' and not isinstance(value, str):
+                    raise ValueError('Expected key at offset {} of panelists file'.format(offset + pos))
+                pos = end
+                if expected == 'value':
+                    yield key, value
+                    expected = ','
+                else:
+                    key = value
+                    expected = ':'
+                continue
+            if eof:
+                raise ValueError('Invalid value at offset {} of panelists file'.format(offset + pos))
+        elif eof:
+            if expected == 'end':
+                return
+            raise ValueError('Unexpected end of panelists file')
+
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        offset += pos
+        buffer, pos = buffer[pos:] + chunk, 0
+
+
+def iter_jsonl(f):
+    for line in f:
+        if line.strip():
+            panelist_data = json.loads(line)
+            yield str(panelist_data.pop('id')), panelist_data
+
+
+def iter_panelists(path):
+    with open(path) as f:
+        if path.endswith('.jsonl'):
+            yield from iter_jsonl(f)
+        else:
+            yield from iter_json_object(f)
+
+
+class ColumnarWriter:
+    """
+    Writes panel of known size in columnar format chunk by chunk, directly to memory mapped arrays.
+    """
+
+    def __init__(self, path, size, demo_names, demo_values):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'demo.json'), 'w') as f:
+            json.dump({'names': demo_names, 'values': demo_values}, f)
+        code_type = np.min_scalar_type(max(map(len, demo_values), default=0))
+        self.ids = np.lib.format.open_memmap(os.path.join(path, 'ids.npy'), 'w+', np.int64, (size,))
+        self.codes = np.lib.format.open_memmap(
+            os.path.join(path, 'codes.npy'), 'w+', code_type, (size, len(demo_names))
+        )
+        self.metric = np.lib.format.open_memmap(os.path.join(path, 'metric.npy'), 'w+', float, (size,))
+        self.position = 0
+
+    def write(self, ids, codes, metric):
+        end = self.position + len(ids)
+        self.ids[self.position:end] = ids
+        self.codes[self.position:end] = codes
+        self.metric[self.position:end] = metric
+        self.position = end
+
+    def close(self):
+        for column in (self.ids, self.codes, self.metric):
+            column.flush()
+
+
+def read_columnar(path):
+    with open(os.path.join(path, 'demo.json')) as f:
+        demo = json.load(f)
+    return weighting.Panel(
+        np.load(os.path.join(path, 'ids.npy'), mmap_mode='r'),
+        demo['names'],
+        demo['values'],
+        np.load(os.path.join(path, 'codes.npy'), mmap_mode='r'),
+        np.load(os.path.join(path, 'metric.npy'), mmap_mode='r'),
+    )
+
+
+def read_panel(path):
+    """
+    Folds panelists into numbers of panelists in crosses. Only integer id and cross index of every panelist
+    is kept, in arrays of 12 bytes per panelist, and original ids only once some id is not a plain decimal
+    number. Panels in columnar format are assigned to crosses at once.
+    """
+    if os.path.isdir(path):
+        return weighting.get_crossed_panel(read_columnar(path))
+
+    ids, cross_index, cross_sizes = array('q'), array('i'), array('q')
+    crosses = {}
+    labels = None
+    for panelist_id, panelist_data in iter_panelists(path):
+        index = crosses.setdefault(weighting.get_panelist_cross(panelist_data), len(crosses))
+        if index == len(cross_sizes):
+            cross_sizes.append(0)
+        cross_sizes[index] += 1
+        ids.append(int(panelist_id))
+        cross_index.append(index)
+        if labels is None and str(ids[-1]) != panelist_id:
+            labels = list(map(str, ids[:-1]))
+        if labels is not None:
+            labels.append(panelist_id)
+    return weighting.CrossedPanel(
+        np.frombuffer(ids, dtype=np.int64),
+        np.frombuffer(cross_index, dtype=np.int32),
+        list(crosses),
+        np.frombuffer(cross_sizes, dtype=np.int64),
+        None if labels is None else np.array(labels, dtype=object)
+    )
+
+
+def _iter_chunks(ids, weights, chunk_size):
+    for start in range(0, len(ids), chunk_size):
+        yield from zip(ids[start:start + chunk_size].tolist(), weights[start:start + chunk_size].tolist())
+
+
+def write_weights(path, ids, weights, chunk_size=CHUNK_SIZE):
+    """
+    Writes weights according to file extension: `.jsonl` as one `{"id": ..., "weight": ...}` object per line,
+    `.npz` as `ids` and `weights` arrays, anything else as the regular weights JSON object.
+    """
+    if path.endswith('.npz'):
+        np.savez(path, ids=ids.astype(str) if ids.dtype == object else ids, weights=weights)
+        return
+
+    with open(path, 'w') as f:
+        if path.endswith('.jsonl'):
+            for panelist_id, weight in _iter_chunks(ids, weights, chunk_size):
+                f.write('{{"id": {}, "weight": {}}}\n'.format(json.dumps(str(panelist_id)), json.dumps(weight)))
+            return
+
+        separator = '{\n'
+        for panelist_id, weight in _iter_chunks(ids, weights, chunk_size):
+            f.write('{}    {}: {}'.format(separator, json.dumps(str(panelist_id)), json.dumps(weight)))
+            separator = ',\n'
+        f.write('\n}' if separator == ',\n' else '{}')
+
+
+def run(population_path, panelists_path, output_path, eclipse_bin_path, print_we, solver='eclipse'):
+    with open(population_path) as f:
+        population = json.load(f)
+
+    panel = read_panel(panelists_path)
+    model = weighting.build_crosses_model(
+        population, dict(zip(panel.crosses, panel.cross_sizes.tolist())), len(panel.ids)
+    )
+    cross_populations = weighting.SOLVERS[solver](model, eclipse_bin_path)
+    ids, weights = weighting.get_panel_weights(panel, model.crosses, cross_populations)
+    write_weights(output_path, ids, weights)
+
+    if print_we:
+        print('Weighting efficiency', weighting.calc_weighting_efficiency(weights))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--panelists", help='panelists JSON or JSON Lines (.jsonl) file, or columnar panel directory')
+    parser.add_argument("--population")
+    parser.add_argument("--output", help='weights JSON, JSON Lines (.jsonl) or NumPy (.npz) file')
+    parser.add_argument("--print-we", action='store_true', default=False)
+    parser.add_argument("--eclipse-bin", default=weighting.ECLIPSE_BIN)
+    parser.add_argument("--solver", choices=sorted(weighting.SOLVERS), default='eclipse')
+
+    args = parser.parse_args()
+    run(
+        panelists_path=args.panelists,
+        population_path=args.population,
+        output_path=args.output,
+        eclipse_bin_path=args.eclipse_bin,
+        print_we=args.print_we,
+        solver=args.solver
+    )
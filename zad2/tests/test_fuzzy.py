@@ -67,3 +67,11 @@ class FuzzyTest(TestBase):
 
     def test_poland_10(self):
         self._run_fuzzy_test('test_poland_10')
+
+
+class MilpFuzzyTest(FuzzyTest):
+    SOLVER = 'milp'
+
+
+class RakeFuzzyTest(FuzzyTest):
+    METHOD = 'rake'
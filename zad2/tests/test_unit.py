@@ -1,16 +1,26 @@
+import io
 import json
 import os
-from collections import namedtuple
-from tempfile import NamedTemporaryFile
+from collections import defaultdict, namedtuple
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest import mock
+
+import numpy as np
+
+import generate_random_panel
+import panel_stream
 import weighting
+import weighting_batch
 from unittest import TestCase
 
 
 class TestBase(TestCase):
     BASE_PATH = os.path.dirname(os.path.abspath(__file__))
-    ECLIPSE_BIN = os.environ.get('ECLIPSE_BIN', '/opt/eclipse/eclipse_clp/bin/x86_64_linux/eclipse')
+    ECLIPSE_BIN = os.environ.get('ECLIPSE_BIN', weighting.ECLIPSE_BIN)
     ARGS_CLS = namedtuple('Args', ['panelists', 'population', 'output', 'eclipse_bin'])
     TEST_DATA_PATH = None  # override in subclass
+    SOLVER = 'eclipse'
+    METHOD = 'exact'
 
     def setUp(self) -> None:
         self.maxDiff = 10 ** 6
@@ -28,7 +38,9 @@ class TestBase(TestCase):
                 population_path=self._population_path(test_path),
                 output_path=f.name,
                 eclipse_bin_path=self.ECLIPSE_BIN,
-                print_we=False
+                print_we=False,
+                solver=self.SOLVER,
+                method=self.METHOD
             )
 
             with open(f.name) as file:
@@ -60,3 +72,310 @@ class IntegrationTests(TestBase):
     def test_conflicting_data(self):
         with self.assertRaises(weighting.WeightingError):
             self._run_eclipse('test_conflicting_data')
+
+    def test_original_ids(self):
+        population = {'total': 10, 'sex': {'m': 6, 'k': 4}}
+        panelists = {'003': {'demo': {'sex': 'k'}}, '01': {'demo': {'sex': 'm'}}, '2': {'demo': {'sex': 'k'}}}
+        weights = weighting.weight(
+            population, panelists, solver=self.SOLVER, eclipse_bin_path=self.ECLIPSE_BIN, method=self.METHOD
+        )
+        self.assertEqual(list(weights.items()), [('01', 6.0), ('2', 2.0), ('003', 2.0)])
+
+
+class MilpIntegrationTests(IntegrationTests):
+    SOLVER = 'milp'
+
+
+class RakeIntegrationTests(IntegrationTests):
+    METHOD = 'rake'
+
+    def test_crosses_division(self):
+        self.skipTest('raking splits crosses by products of per-value factors (4.5/10.5/1.5/3.5), not by program cost')
+
+    def test_trim(self):
+        population = {'total': 10, 'sex': {'m': 9, 'k': 1}}
+        panelists = {'1': {'demo': {'sex': 'm'}}, '2': {'demo': {'sex': 'k'}}}
+        self.assertEqual(weighting.rake(population, panelists), {'1': 9.0, '2': 1.0})
+        with self.assertRaises(weighting.WeightingError):
+            weighting.rake(population, panelists, max_iterations=10, trim=(0.5, 1.5))
+
+
+def build_model(population, panelists):
+    crossed_panel = weighting.get_crossed_panel(weighting.get_panel(panelists))
+    cross_sizes = dict(zip(crossed_panel.crosses, crossed_panel.cross_sizes.tolist()))
+    return weighting.build_crosses_model(population, cross_sizes, len(panelists))
+
+
+class ModelTests(TestBase):
+    TEST_DATA_PATH = os.path.join(TestBase.BASE_PATH, 'test_data')
+
+    def _read_test_data(self, test_path):
+        with open(self._population_path(test_path)) as f:
+            population = json.load(f)
+        with open(self._panelists_path(test_path)) as f:
+            panelists = json.load(f)
+        return population, panelists
+
+    def test_only_populated_crosses(self):
+        population, panelists = self._read_test_data('test_multiple_age_groups')
+        model = build_model(population, panelists)
+        self.assertEqual(model.n_crosses, len({weighting.get_panelist_cross(p) for p in panelists.values()}))
+        self.assertEqual(len(model.variables), 2 * model.n_crosses)
+
+    def test_conflicting_data(self):
+        with self.assertRaises(weighting.WeightingError):
+            build_model(*self._read_test_data('test_conflicting_data'))
+
+    def test_crossed_panel(self):
+        _, panelists = self._read_test_data('test_multiple_age_groups')
+        crossed_panel = weighting.get_crossed_panel(weighting.get_panel(panelists))
+        crosses_population = defaultdict(set)
+        for panelist_id, panelist_data in panelists.items():
+            crosses_population[weighting.get_panelist_cross(panelist_data)].add(panelist_id)
+        self.assertEqual(
+            dict(zip(crossed_panel.crosses, crossed_panel.cross_sizes.tolist())),
+            {cross: len(ids) for cross, ids in crosses_population.items()}
+        )
+        for panelist_id, cross_index in zip(crossed_panel.ids.tolist(), crossed_panel.cross_index.tolist()):
+            self.assertIn(str(panelist_id), crosses_population[crossed_panel.crosses[cross_index]])
+
+    def test_crossed_panel_many_features(self):
+        # 16 ** 17 possible crosses do not fit in int64 keys
+        rng = np.random.default_rng(0)
+        panelists = {
+            str(panelist_id): {'demo': {'d{:02}'.format(j): 'v{}'.format(code) for j, code in enumerate(codes)}}
+            for panelist_id, codes in enumerate(rng.integers(16, size=(2000, 17)).tolist())
+        }
+        panelists['2000'] = dict(panelists['0'])
+        crossed_panel = weighting.get_crossed_panel(weighting.get_panel(panelists))
+        self.assertEqual(len(crossed_panel.crosses), 2000)
+        for panelist_id, cross_index in zip(crossed_panel.ids.tolist(), crossed_panel.cross_index.tolist()):
+            self.assertEqual(
+                crossed_panel.crosses[cross_index], weighting.get_panelist_cross(panelists[str(panelist_id)])
+            )
+        self.assertEqual(crossed_panel.cross_sizes.sum(), 2001)
+
+    def test_value_without_panelists(self):
+        population = {'total': 10, 'sex': {'m': 6, 'k': 4}}
+        panelists = {'1': {'demo': {'sex': 'm'}}}
+        with self.assertRaises(weighting.WeightingError):
+            build_model(population, panelists)
+
+    def test_value_with_too_many_panelists(self):
+        population = {'total': 2, 'sex': {'m': 1, 'k': 1}}
+        panelists = {'1': {'demo': {'sex': 'm'}}, '2': {'demo': {'sex': 'm'}}, '3': {'demo': {'sex': 'k'}}}
+        with self.assertRaises(weighting.WeightingError):
+            build_model(population, panelists)
+
+
+class WeighterTests(TestBase):
+    TEST_DATA_PATH = os.path.join(TestBase.BASE_PATH, 'fuzzy_tests')
+
+    def setUp(self) -> None:
+        super().setUp()
+        with open(self._population_path('test_poland_1')) as f:
+            self.population = json.load(f)
+        with open(self._panelists_path('test_poland_1')) as f:
+            self.panelists = json.load(f)
+
+    def _full_weights(self, panelists):
+        return weighting.weight(self.population, panelists, solver='milp')
+
+    def test_initial_weights(self):
+        weighter = weighting.Weighter(self.population, self.panelists, solver='milp')
+        self.assertEqual(weighter.reweight(), self._full_weights(self.panelists))
+        self.assertEqual(weighter.reweight(), {})
+
+    def test_deltas(self):
+        weighter = weighting.Weighter(self.population, self.panelists, solver='milp')
+        weighter.reweight()
+
+        panelists = dict(self.panelists)
+        removed = [panelist_id for panelist_id in list(panelists)[:20] if panelist_id in weighter.weights]
+        for panelist_id in removed:
+            weighter.remove(panelist_id)
+            del panelists[panelist_id]
+        for i in range(10):
+            panelist_id = str(10000 + i)
+            panelists[panelist_id] = self.panelists[str(100 + i)]
+            weighter.add(panelist_id, panelists[panelist_id])
+        demo = dict(panelists['500']['demo'], sex='k' if panelists['500']['demo']['sex'] == 'm' else 'm')
+        panelists['500'] = dict(panelists['500'], demo=demo)
+        weighter.change_demo('500', demo)
+
+        previous = dict(weighter.weights)
+        changed = weighter.reweight()
+        expected = self._full_weights(panelists)
+        self.assertEqual(weighter.weights, expected)
+        for panelist_id in removed:
+            self.assertIsNone(changed[panelist_id])
+        self.assertEqual(
+            {panelist_id: weight for panelist_id, weight in changed.items() if weight is not None},
+            {panelist_id: weight for panelist_id, weight in expected.items() if previous.get(panelist_id) != weight}
+        )
+
+    def test_original_ids(self):
+        population = {'total': 10, 'sex': {'m': 6, 'k': 4}}
+        panelists = {'003': {'demo': {'sex': 'k'}}, '01': {'demo': {'sex': 'm'}}, '2': {'demo': {'sex': 'k'}}}
+        self.assertEqual(
+            weighting.Weighter(population, panelists, solver='milp').reweight(),
+            weighting.weight(population, panelists, solver='milp')
+        )
+
+    def test_metric_change_keeps_weights(self):
+        weighter = weighting.Weighter(self.population, self.panelists, solver='milp')
+        weighter.reweight()
+        weighter.add('1', dict(self.panelists['1'], metric=0))
+        self.assertEqual(weighter.reweight(), {})
+
+
+class StreamTests(TestBase):
+    TEST_DATA_PATH = os.path.join(TestBase.BASE_PATH, 'fuzzy_tests')
+
+    def test_iter_json_object(self):
+        with open(self._panelists_path('test_poland_2')) as f:
+            panelists = json.load(f)
+        with open(self._panelists_path('test_poland_2')) as f:
+            self.assertEqual(list(panel_stream.iter_json_object(f, chunk_size=7)), list(panelists.items()))
+
+    def test_iter_json_object_numbers(self):
+        content = '{"1": 1.5, "2": -2.25e10, "3": [1, 727.5], "4": true, "5": 10}'
+        for chunk_size in range(1, 12):
+            self.assertEqual(
+                list(panel_stream.iter_json_object(io.StringIO(content), chunk_size=chunk_size)),
+                list(json.loads(content).items())
+            )
+
+    def test_iter_json_object_invalid(self):
+        for content in ['{"1": {}', '{"1" {}}', '[]', '{"1": {}, }', '{"1": {}} x', '{}{}']:
+            with self.assertRaises(ValueError):
+                list(panel_stream.iter_json_object(io.StringIO(content), chunk_size=2))
+        self.assertEqual(list(panel_stream.iter_json_object(io.StringIO('{"1": {}} \n'), chunk_size=2)), [('1', {})])
+
+    def test_original_ids(self):
+        lines = [
+            '{"id": "003", "demo": {"sex": "k"}}',
+            '{"id": "1", "demo": {"sex": "m"}}',
+            '{"id": "02", "demo": {"sex": "k"}}',
+        ]
+        with TemporaryDirectory() as directory:
+            panelists_path = os.path.join(directory, 'panelists.jsonl')
+            with open(panelists_path, 'w') as f:
+                f.write('\n'.join(lines))
+            panel = panel_stream.read_panel(panelists_path)
+            ids, weights = weighting.get_panel_weights(panel, panel.crosses, [2, 1])
+            self.assertEqual(ids.tolist(), ['1', '02', '003'])
+
+            for name in ['weights.json', 'weights.jsonl', 'weights.npz']:
+                panel_stream.write_weights(os.path.join(directory, name), ids, weights)
+            with open(os.path.join(directory, 'weights.json')) as f:
+                self.assertEqual(list(json.load(f)), ['1', '02', '003'])
+            with open(os.path.join(directory, 'weights.jsonl')) as f:
+                self.assertEqual([json.loads(line)['id'] for line in f], ['1', '02', '003'])
+            self.assertEqual(np.load(os.path.join(directory, 'weights.npz'))['ids'].tolist(), ['1', '02', '003'])
+
+    def test_streamed_weights(self):
+        result = self._run_eclipse('test_poland_3')
+        with NamedTemporaryFile(suffix='.jsonl') as f:
+            panel_stream.run(
+                panelists_path=self._panelists_path('test_poland_3'),
+                population_path=self._population_path('test_poland_3'),
+                output_path=f.name,
+                eclipse_bin_path=self.ECLIPSE_BIN,
+                print_we=False,
+                solver=self.SOLVER
+            )
+            with open(f.name) as file:
+                streamed = {line['id']: line['weight'] for line in map(json.loads, file)}
+        self.assertEqual(streamed, result)
+
+
+class MilpStreamTests(StreamTests):
+    SOLVER = 'milp'
+
+
+class BatchTests(TestBase):
+    TEST_DATA_PATH = os.path.join(TestBase.BASE_PATH, 'test_data')
+
+    def _job(self, test_path, output):
+        return weighting_batch.Job(self._panelists_path(test_path), self._population_path(test_path), output)
+
+    def test_batch(self):
+        with NamedTemporaryFile() as f1, NamedTemporaryFile() as f2, NamedTemporaryFile() as f3:
+            jobs = [
+                self._job('test_basic', f1.name),
+                self._job('test_conflicting_data', f2.name),
+                self._job('test_basic', f3.name)._replace(panelists=self._population_path('missing')),
+            ]
+            results = weighting_batch.run_batch(jobs, processes=2, solver=self.SOLVER, eclipse_bin_path=self.ECLIPSE_BIN)
+            self.assertEqual([r.status for r in results], ['ok', 'weighting_error', 'parse_error'])
+            with open(f1.name) as file:
+                weights = json.load(file)
+
+        with open(os.path.join(self.TEST_DATA_PATH, 'test_basic', 'output.json')) as file:
+            self.assertEqual(weights, json.load(file))
+
+
+class MilpBatchTests(BatchTests):
+    SOLVER = 'milp'
+
+
+class SolutionCacheTests(TestBase):
+    TEST_DATA_PATH = os.path.join(TestBase.BASE_PATH, 'fuzzy_tests')
+
+    def _load(self, test_path):
+        with open(self._population_path(test_path)) as f:
+            population = json.load(f)
+        with open(self._panelists_path(test_path)) as f:
+            panelists = json.load(f)
+        return population, panelists
+
+    def test_solver_skipped(self):
+        population, panelists = self._load('test_poland_5')
+        with TemporaryDirectory() as directory:
+            cache = weighting.SolutionCache(directory)
+            weights = weighting.weight(population, panelists, solver='milp', cache=cache)
+            with mock.patch.dict(weighting.SOLVERS, {'milp': mock.Mock(side_effect=AssertionError)}):
+                self.assertEqual(weighting.weight(population, panelists, solver='milp', cache=cache), weights)
+
+    def test_eviction(self):
+        with TemporaryDirectory() as directory:
+            cache = weighting.SolutionCache(directory, max_size=60)
+            solution = {(('age', '15-19'), ('sex', 'm')): 10}
+            cache.put('first', solution)
+            os.utime(os.path.join(directory, 'first.json'), (0, 0))
+            cache.put('second', solution)
+            self.assertIsNone(cache.get('first'))
+            self.assertEqual(cache.get('second'), solution)
+
+
+class GeneratorTests(TestCase):
+    def _generate(self, directory, name, chunk_size):
+        generate_random_panel.run(
+            population_file=os.path.join(directory, 'population.json'),
+            panelists_file=os.path.join(directory, name),
+            number_of_panelists=500,
+            cardinalities=[2, 3, 11],
+            seed=7,
+            chunk_size=chunk_size
+        )
+        return panel_stream.read_panel(os.path.join(directory, name))
+
+    def test_formats_and_chunks(self):
+        with TemporaryDirectory() as directory:
+            panels = [
+                self._generate(directory, 'panelists.json', 500),
+                self._generate(directory, 'panelists.jsonl', 64),
+                self._generate(directory, 'columnar', 101),
+            ]
+            with open(os.path.join(directory, 'population.json')) as f:
+                population = json.load(f)
+
+        for panel in panels[1:]:
+            self.assertEqual(panel.ids.tolist(), panels[0].ids.tolist())
+            self.assertEqual(
+                [panel.crosses[i] for i in panel.cross_index], [panels[0].crosses[i] for i in panels[0].cross_index]
+            )
+        self.assertEqual(sorted(population), ['d0', 'd1', 'd2', 'total'])
+        for demo_name in ['d0', 'd1', 'd2']:
+            self.assertEqual(sum(population[demo_name].values()), population['total'])
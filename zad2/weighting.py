@@ -1,19 +1,23 @@
 #!/usr/bin/python3
 
 import argparse
+import hashlib
 import itertools
 import json
+import os
 import subprocess
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, namedtuple, OrderedDict
 from tempfile import NamedTemporaryFile
 
+import numpy as np
+from scipy.optimize import Bounds, LinearConstraint, milp
+from scipy.sparse import csr_matrix
 
-class WeightingError(Exception):
-    pass
+ECLIPSE_BIN = '/opt/eclipse/eclipse_clp/bin/x86_64_linux/eclipse'
 
 
-def get_all_ids(panelists):
-    return ', '.join(map(lambda x: 'X' + x, panelists))
+class WeightingError(Exception):
+    pass
 
 
 def get_cross_name(cross):
@@ -28,17 +32,6 @@ def get_crosses_names(crosses):
     return [get_cross_name(cross) for cross in crosses]
 
 
-def get_cross_mapping(crosses):
-    return {
-        get_cross_name(cross): cross
-        for cross in crosses
-    }
-
-
-def product(lists):
-    return list(itertools.product(*lists))
-
-
 def _rename_population(population):
     new_population = {}
     for demo_name, demo_vals in population.items():
@@ -51,73 +44,223 @@ def _rename_population(population):
     return new_population
 
 
-def get_crosses_population(panelists, renamed_population, all_crosses):
-    crosses_population = defaultdict(list)
+def get_panelist_cross(panelist_data):
+    return tuple(sorted(panelist_data['demo'].items()))
 
-    demo_to_crosses_map = {
-        cls: []
-        for cls in itertools.chain(*renamed_population.values())
-    }
 
-    for cross in all_crosses:
-        for part in cross:
-            demo_to_crosses_map[part].append(cross)
+# ids are integer sort keys of panelists, labels their original ids, None when every id is written
+# as its plain decimal number (labels are kept only for ids like '01')
+Panel = namedtuple('Panel', ['ids', 'demo_names', 'demo_values', 'codes', 'metric', 'labels'], defaults=(None,))
+CrossedPanel = namedtuple('CrossedPanel', ['ids', 'cross_index', 'crosses', 'cross_sizes', 'labels'], defaults=(None,))
 
-    for panelist_id, panelist_data in panelists.items():
-        demo_vals = []
-        for demo_id, demo_val in sorted(panelist_data['demo'].items()):
-            demo_vals.append((demo_id, demo_val))
-        crosses_population[tuple(demo_vals)].append(panelist_id)
-    return crosses_population, demo_to_crosses_map
 
+def get_labels(panelist_ids, ids):
+    if all(str(i) == panelist_id for i, panelist_id in zip(ids.tolist(), panelist_ids)):
+        return None
+    return np.array(panelist_ids, dtype=object)
 
-def generate_program_cmd(population, panelists):
-    renamed_population = _rename_population(population)
-    all_crosses = product(value for key, value in sorted(renamed_population.items()))
-    all_cross_names = get_crosses_names(all_crosses)
-    cross_mapping = get_cross_mapping(all_crosses)
 
-    program = [
-        ':- lib(eplex).',
-        'answer({all_ids}) :-'.format(all_ids=', '.join(all_cross_names)),
-        '  integers([{all_ids}]),'.format(all_ids=', '.join(all_cross_names))
+def get_panel(panelists):
+    """
+    Converts panelists to columns: integer ids, metric and code of demographic value of every panelist,
+    one column for every demographic feature sorted by name. demo_values map codes back to values.
+    """
+    ids = np.fromiter(map(int, panelists), dtype=np.int64, count=len(panelists))
+    labels = get_labels(list(panelists), ids)
+    metric = np.fromiter(
+        (panelist_data.get('metric', 0) for panelist_data in panelists.values()), dtype=float, count=len(panelists)
+    )
+    demo_names = sorted({demo_name for panelist_data in panelists.values() for demo_name in panelist_data['demo']})
+    demo_values, columns = [], []
+    for demo_name in demo_names:
+        value_codes = {}
+        columns.append([
+            value_codes.setdefault(panelist_data['demo'].get(demo_name), len(value_codes))
+            for panelist_data in panelists.values()
+        ])
+        demo_values.append(list(value_codes))
+    dtype = np.min_scalar_type(max(map(len, demo_values), default=0))
+    codes = np.array(columns, dtype=dtype).T.reshape(len(panelists), len(demo_names))
+    return Panel(ids, demo_names, demo_values, codes, metric, labels)
+
+
+def get_crossed_panel(panel):
+    """
+    Assigns panelists to crosses. Codes of every panelist are combined into a single number,
+    so crosses are found by one np.unique call. When the number of all possible crosses does not fit
+    in int64, rows of codes are compared instead, which is slower.
+    """
+    cardinalities = np.array([max(len(values), 1) for values in panel.demo_values], dtype=np.int64)
+    if np.prod(cardinalities.astype(object)) <= np.iinfo(np.int64).max:
+        strides = np.cumprod(np.concatenate([cardinalities[1:], [1]])[::-1])[::-1]
+        keys = panel.codes.astype(np.int64) @ strides
+        cross_keys, cross_index, cross_sizes = np.unique(keys, return_inverse=True, return_counts=True)
+        cross_codes = cross_keys[:, None] // strides % cardinalities
+    else:
+        cross_codes, cross_index, cross_sizes = np.unique(
+            panel.codes, axis=0, return_inverse=True, return_counts=True
+        )
+        cross_index = cross_index.reshape(-1)
+    crosses = [
+        tuple(
+            (demo_name, values[code])
+            for demo_name, values, code in zip(panel.demo_names, panel.demo_values, codes)
+            if values[code] is not None
+        )
+        for codes in cross_codes.tolist()
     ]
+    return CrossedPanel(panel.ids, cross_index.astype(np.int32), crosses, cross_sizes, panel.labels)
 
-    crosses_population, demo_to_crosses_map = get_crosses_population(panelists, renamed_population, all_crosses)
 
-    for (demo_name, demo_val), crosses in demo_to_crosses_map.items():
-        program.append('  {crosses_sum} $= {population},'.format(
-            population=population[demo_name][demo_val],
-            crosses_sum=' + '.join(get_crosses_names(crosses))
-        ))
+WeightingModel = namedtuple('WeightingModel', [
+    'variables', 'n_crosses', 'matrix', 'lower', 'upper', 'var_lower', 'integrality', 'cost', 'crosses'
+])
 
-    costs_abs = []
-    panelists_len = len(panelists)
-    for i, (cross, input_cross_population) in enumerate(crosses_population.items()):
-        name = get_cross_name(cross)
-        cross_cost = '{cross} * {rev_output_population} - {input_cross_perc}'.format(
-            cross=name,
-            rev_output_population=1 / population['total'],
-            input_cross_perc=len(input_cross_population) / panelists_len
-        )
-        cost_abs = 'A{}'.format(i)
-        costs_abs.append(cost_abs)
-        program.extend([
-            '  {cross} $>= {input_pop},'.format(cross=name, input_pop=len(input_cross_population)),
-            '  {cross_cost} $=< {cost_abs},'.format(cross_cost=cross_cost, cost_abs=cost_abs),
-            '  {cross_cost} $>= -1 * {cost_abs},'.format(cross_cost=cross_cost, cost_abs=cost_abs),
-            '  {cost_abs} $>= 0,'.format(cost_abs=cost_abs)
-        ])
 
-    program.append(
-        '  Cost $= {all_abs},'.format(
-            all_abs=' + '.join(costs_abs)
-        )
+def check_marginals(population, cross_sizes):
+    """
+    Raises WeightingError when demographic populations cannot be met by populated crosses, before any solver
+    is started: all demographic features must sum up to the same population, every value with positive
+    population needs panelists and no value can have more panelists than population.
+    """
+    sums = {demo_name: sum(demo_vals.values()) for demo_name, demo_vals in population.items() if demo_name != 'total'}
+    if len(set(sums.values())) > 1:
+        raise WeightingError('Demographic features sum up to different populations: {}'.format(sums))
+
+    panelists_count = defaultdict(int)
+    for cross, size in cross_sizes.items():
+        for demo in cross:
+            panelists_count[demo] += size
+    for demo_name, demo_vals in population.items():
+        if demo_name == 'total':
+            continue
+        for demo_val, demo_population in demo_vals.items():
+            count = panelists_count[(demo_name, demo_val)]
+            if count == 0 and demo_population > 0:
+                raise WeightingError('No panelists with {} {}'.format(demo_name, demo_val))
+            if count > demo_population:
+                raise WeightingError('{} panelists with {} {} exceed its population {}'.format(
+                    count, demo_name, demo_val, demo_population
+                ))
+
+
+def build_crosses_model(population, cross_sizes, panelists_len):
+    """
+    Builds weighting program as a sparse constraint matrix with bound vectors, consumed by every solver.
+    Variables are populations of crosses with panelists, in order of product of sorted demographic values,
+    followed by their absolute costs:
+      - for every demographic value sum of its crosses equals its population,
+      - every cross is not smaller than number of its panelists,
+      - cost of cross is at least |cross - total * panelists_in_cross / panelists|,
+    and the sum of costs is minimized. Cost rows are multiplied by population total with regard to
+    the README formula, which gives the same optimum with better scaled coefficients.
+    Crosses without panelists cannot get any weight, so they are left out of the program.
+    Panelists are given only as numbers of panelists in crosses.
+    """
+    renamed_population = _rename_population(population)
+    demo_values = [values for key, values in sorted(renamed_population.items())]
+    value_rows = {demo: i for i, demo in enumerate(itertools.chain.from_iterable(demo_values))}
+    targets = [population[demo_name][demo_val] for demo_name, demo_val in value_rows]
+
+    # crosses with demographic values missing from population take no part in the program
+    populated = sorted(
+        (tuple(value_rows[demo] for demo in cross), cross)
+        for cross in cross_sizes
+        if len(cross) == len(demo_values) and all(demo in value_rows for demo in cross)
+    )
+    crosses = [cross for _, cross in populated]
+    check_marginals(population, {cross: cross_sizes[cross] for cross in crosses})
+
+    n_crosses = len(crosses)
+    cross_ids = np.arange(n_crosses)
+    cross_rows = np.array([rows for rows, _ in populated], dtype=int).reshape(n_crosses, len(demo_values))
+    sizes = np.array([cross_sizes[cross] for cross in crosses], dtype=float)
+    cost_ids = n_crosses + cross_ids
+    cost_targets = population['total'] * sizes / panelists_len
+
+    # every cross belongs to one value of every demographic feature
+    rows = list(cross_rows.T)
+    cols = [cross_ids] * len(demo_values)
+    vals = [np.ones(n_crosses)] * len(demo_values)
+
+    # cross - cost <= target and cross + cost >= target, for every cross
+    upper_rows = len(targets) + 2 * cross_ids
+    rows.extend([upper_rows, upper_rows, upper_rows + 1, upper_rows + 1])
+    cols.extend([cross_ids, cost_ids, cross_ids, cost_ids])
+    vals.extend([np.ones(n_crosses), -np.ones(n_crosses), np.ones(n_crosses), np.ones(n_crosses)])
+
+    n_rows = len(targets) + 2 * n_crosses
+    lower = np.full(n_rows, -np.inf)
+    upper = np.full(n_rows, np.inf)
+    lower[:len(targets)] = upper[:len(targets)] = targets
+    upper[len(targets)::2] = cost_targets
+    lower[len(targets) + 1::2] = cost_targets
+
+    n_vars = 2 * n_crosses
+    var_lower = np.zeros(n_vars)
+    var_lower[:n_crosses] = sizes
+    integrality = np.zeros(n_vars)
+    integrality[:n_crosses] = 1
+    cost = np.zeros(n_vars)
+    cost[n_crosses:] = 1
+
+    matrix = csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_rows, n_vars)
+    )
+    variables = get_crosses_names(crosses) + ['A{}'.format(i) for i in range(n_crosses)]
+    return WeightingModel(
+        variables, n_crosses, matrix, lower, upper, var_lower, integrality, cost, crosses
     )
 
+
+def _format_number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _format_sum(coefficients, variables):
+    terms = [
+        var if coef == 1 else '{} * {}'.format(_format_number(coef), var)
+        for coef, var in zip(coefficients, variables)
+    ]
+    return ' + '.join(terms) or '0'
+
+
+def generate_program_cmd(model):
+    cross_names = model.variables[:model.n_crosses]
+    program = [
+        ':- lib(eplex).',
+        'answer({all_ids}) :-'.format(all_ids=', '.join(cross_names)),
+        '  integers([{all_ids}]),'.format(all_ids=', '.join(
+            var for var, integer in zip(model.variables, model.integrality) if integer
+        ))
+    ]
+
+    matrix = model.matrix
+    for row in range(matrix.shape[0]):
+        row_slice = slice(matrix.indptr[row], matrix.indptr[row + 1])
+        row_sum = _format_sum(matrix.data[row_slice], [model.variables[i] for i in matrix.indices[row_slice]])
+        lower, upper = model.lower[row], model.upper[row]
+        if lower == upper:
+            program.append('  {} $= {},'.format(row_sum, _format_number(lower)))
+            continue
+        if np.isfinite(upper):
+            program.append('  {} $=< {},'.format(row_sum, _format_number(upper)))
+        if np.isfinite(lower):
+            program.append('  {} $>= {},'.format(row_sum, _format_number(lower)))
+
+    for var, lower in zip(model.variables, model.var_lower):
+        if np.isfinite(lower):
+            program.append('  {} $>= {},'.format(var, _format_number(lower)))
+
+    cost_ids = np.nonzero(model.cost)[0]
+    program.append('  Cost $= {},'.format(
+        _format_sum(model.cost[cost_ids], [model.variables[i] for i in cost_ids])
+    ))
     program.append('  eplex_solver_setup(min(Cost)),')
     program.append('  eplex_solve(Cost).')
-    return program, all_cross_names, crosses_population, cross_mapping
+    return program
 
 
 def run_eclipse(eclipse_bin, program_cmd, result_cmd):
@@ -182,42 +325,283 @@ def parse_result(result_lines):
     return result
 
 
-def get_weights(crosses, cross_mapping, crosses_panelists):
-    weights = {}
-    for cross_name, population in crosses.items():
-        panelists = crosses_panelists[cross_mapping[cross_name]]
-        for panelist_id in panelists:
-            weights[panelist_id] = population / len(panelists)
-    weights = OrderedDict(sorted(weights.items(), key=lambda x: int(x[0])))
-    return weights
+def solve_eclipse(model, eclipse_bin_path):
+    cross_names = model.variables[:model.n_crosses]
+    eclipse_result = run_eclipse(
+        eclipse_bin=eclipse_bin_path,
+        program_cmd='\n'.join(generate_program_cmd(model)),
+        result_cmd='answer({all_ids}).'.format(all_ids=', '.join(cross_names))
+    )
+    crosses = parse_result(eclipse_result)
+    return np.array([crosses[name] for name in cross_names])
+
+
+def solve_milp(model, eclipse_bin_path=None):
+    """
+    Solves the model in process with HiGHS MILP solver from scipy.
+    """
+    result = milp(
+        model.cost,
+        integrality=model.integrality,
+        bounds=Bounds(model.var_lower, np.inf),
+        constraints=LinearConstraint(model.matrix, model.lower, model.upper)
+    )
+    if result.status != 0:
+        raise WeightingError('Weighting failed. Solver status: {}'.format(result.message))
+    return np.round(result.x[:model.n_crosses]).astype(int)
+
+
+SOLVERS = {
+    'eclipse': solve_eclipse,
+    'milp': solve_milp,
+}
+
+
+class SolutionCache:
+    """
+    On disk cache of solved populations of crosses. Solution depends only on numbers of panelists in crosses,
+    populations and solver, so their hash is the key. Least recently used solutions are removed when
+    the cache grows over max_size bytes.
+    """
+
+    def __init__(self, directory, max_size=64 * 2 ** 20):
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def key(population, cross_sizes, panelists_len, solver):
+        signature = json.dumps({
+            'population': population,
+            'crosses': sorted([list(map(list, cross)), size] for cross, size in cross_sizes.items()),
+            'panelists': panelists_len,
+            'solver': solver,
+        }, sort_keys=True)
+        return hashlib.sha256(signature.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                solution = json.load(f)
+            os.utime(self._path(key))
+        except (FileNotFoundError, ValueError):
+            return None
+        return {tuple(map(tuple, cross)): population for cross, population in solution}
+
+    def put(self, key, solution):
+        os.makedirs(self.directory, exist_ok=True)
+        # written to a temporary file first, so concurrent readers never see a partial solution
+        with NamedTemporaryFile('w', dir=self.directory, suffix='.tmp', delete=False) as f:
+            json.dump([[cross, population] for cross, population in solution.items()], f)
+        os.replace(f.name, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+
+def sort_weights(weights):
+    return OrderedDict(sorted(weights, key=lambda x: int(x[0])))
+
+
+def get_panel_weights(crossed_panel, crosses, cross_populations):
+    """
+    Spreads populations of crosses over their panelists. Returns ids (original labels, if panel has them)
+    and weights sorted by id, panelists of crosses missing from the solution are not weighted.
+    """
+    cross_ids = {cross: i for i, cross in enumerate(crossed_panel.crosses)}
+    cross_weights = np.full(len(crossed_panel.crosses), np.nan)
+    solved_ids = np.array([cross_ids[cross] for cross in crosses], dtype=int)
+    cross_weights[solved_ids] = np.asarray(cross_populations, dtype=float) / crossed_panel.cross_sizes[solved_ids]
+
+    weights = cross_weights[crossed_panel.cross_index]
+    weighted = ~np.isnan(weights)
+    labels = None if crossed_panel.labels is None else crossed_panel.labels[weighted]
+    return sort_panel_weights(crossed_panel.ids[weighted], labels, weights[weighted])
+
+
+def sort_panel_weights(ids, labels, weights):
+    order = np.argsort(ids, kind='stable')
+    return (ids if labels is None else labels)[order], weights[order]
+
+
+def weights_to_dict(ids, weights):
+    return OrderedDict(zip(map(str, ids.tolist()), weights.tolist()))
+
+
+def rake(population, panelists, tolerance=1e-9, max_iterations=1000, trim=None):
+    """
+    Iterative proportional fitting (RIM weighting). Weights of all panelists are scaled in turn to match
+    population of every demographic value, until the largest marginal error relative to population total
+    drops below tolerance. trim is a pair of minimal and maximal weight, as multiples of mean weight,
+    applied after every iteration. Like in exact weighting, panelists with demographic values missing from
+    population are not weighted.
+    """
+    panel = get_panel(panelists)
+    codes, targets = [], []
+    weighted = np.ones(len(panel.ids), dtype=bool)
+    for demo_name, demo_vals in sorted(population.items()):
+        if demo_name == 'total':
+            continue
+        if demo_name not in panel.demo_names:
+            raise WeightingError('Panelists have no {} demographic feature'.format(demo_name))
+        column = panel.demo_names.index(demo_name)
+        value_codes = {demo_val: i for i, demo_val in enumerate(demo_vals)}
+        # maps codes of panel values to codes of population values, -1 for values missing from population
+        code_map = np.array([value_codes.get(demo_val, -1) for demo_val in panel.demo_values[column]])
+        code = code_map[panel.codes[:, column]]
+        weighted &= code >= 0
+        codes.append(code)
+        targets.append(np.array(list(demo_vals.values()), dtype=float))
+
+    if not weighted.any():
+        raise WeightingError('No panelists matching population')
+    ids = panel.ids[weighted]
+    labels = None if panel.labels is None else panel.labels[weighted]
+    codes = [code[weighted] for code in codes]
+    mean_weight = population['total'] / len(ids)
+    for demo_name, code, target in zip(sorted(set(population) - {'total'}), codes, targets):
+        empty = (np.bincount(code, minlength=len(target)) == 0) & (target > 0)
+        if empty.any():
+            raise WeightingError('No panelists with {} in {}'.format(
+                [demo_val for demo_val, is_empty in zip(population[demo_name], empty) if is_empty], demo_name
+            ))
+
+    weights = np.full(len(ids), mean_weight)
+    error = None
+    for _ in range(max_iterations):
+        for code, target in zip(codes, targets):
+            sums = np.bincount(code, weights=weights, minlength=len(target))
+            weights *= (target / np.where(sums > 0, sums, 1))[code]
+        if trim is not None:
+            np.clip(weights, trim[0] * mean_weight, trim[1] * mean_weight, out=weights)
+
+        error = max(
+            np.abs(np.bincount(code, weights=weights, minlength=len(target)) - target).max()
+            for code, target in zip(codes, targets)
+        ) / population['total']
+        if error <= tolerance:
+            return weights_to_dict(*sort_panel_weights(ids, labels, weights))
+
+    raise WeightingError('Raking did not converge in {} iterations, marginal error: {}'.format(
+        max_iterations, error
+    ))
 
 
 def calc_weighting_efficiency(weights):
-    w_square_sum = 0
-    w_sum = 0
-    w_len = 0
-    for weight in weights.values():
-        w_len += 1
-        w_sum += weight
-        w_square_sum += weight ** 2
-    return 100 * (w_sum ** 2 / w_len) / w_square_sum
-
-
-def run(population_path, panelists_path, output_path, eclipse_bin_path, print_we):
+    if isinstance(weights, dict):
+        weights = np.fromiter(weights.values(), dtype=float, count=len(weights))
+    return float(100 * (weights.sum() ** 2 / len(weights)) / (weights ** 2).sum())
+
+
+class Weighter:
+    """
+    Long-lived weighting of a changing panel. Panelists are kept grouped by crosses between reweightings,
+    so deltas only move single panelists between crosses. The program is solved again only when numbers
+    of panelists in crosses have changed, otherwise previous populations of crosses are reused.
+    """
+
+    def __init__(self, population, panelists=(), solver='eclipse', eclipse_bin_path=ECLIPSE_BIN):
+        self.population = population
+        self.solver = solver
+        self.eclipse_bin_path = eclipse_bin_path
+        self.panelists = {}
+        self.crosses_population = defaultdict(set)
+        self.weights = {}
+        self._solved_counts = None
+        self._crosses = {}
+        for panelist_id, panelist_data in dict(panelists).items():
+            self.add(panelist_id, panelist_data)
+
+    def add(self, panelist_id, panelist_data):
+        if panelist_id in self.panelists:
+            self.remove(panelist_id)
+        self.panelists[panelist_id] = panelist_data
+        self.crosses_population[get_panelist_cross(panelist_data)].add(panelist_id)
+
+    def remove(self, panelist_id):
+        cross = get_panelist_cross(self.panelists.pop(panelist_id))
+        self.crosses_population[cross].discard(panelist_id)
+        if not self.crosses_population[cross]:
+            del self.crosses_population[cross]
+
+    def change_demo(self, panelist_id, demo):
+        panelist_data = dict(self.panelists[panelist_id], demo=demo)
+        self.add(panelist_id, panelist_data)
+
+    def reweight(self):
+        """
+        Returns weights changed since previous reweighting, sorted by panelist id.
+        Removed panelists are returned with None weight.
+        """
+        cross_sizes = {cross: len(ids) for cross, ids in self.crosses_population.items()}
+        counts = (cross_sizes, len(self.panelists))
+        if counts != self._solved_counts:
+            model = build_crosses_model(self.population, cross_sizes, len(self.panelists))
+            cross_populations = SOLVERS[self.solver](model, self.eclipse_bin_path)
+            self._crosses = dict(zip(model.crosses, cross_populations.tolist()))
+            self._solved_counts = counts
+
+        weights = {}
+        for cross, population in self._crosses.items():
+            panelists = self.crosses_population[cross]
+            for panelist_id in panelists:
+                weights[panelist_id] = population / len(panelists)
+
+        changed = [(panelist_id, weight) for panelist_id, weight in weights.items()
+                   if self.weights.get(panelist_id) != weight]
+        changed.extend((panelist_id, None) for panelist_id in self.weights if panelist_id not in weights)
+        self.weights = weights
+        return sort_weights(changed)
+
+
+def weight(population, panelists, solver='eclipse', eclipse_bin_path=ECLIPSE_BIN, method='exact',
+           tolerance=1e-9, max_iterations=1000, trim=None, cache=None):
+    if method == 'rake':
+        return rake(population, panelists, tolerance, max_iterations, trim)
+
+    crossed_panel = get_crossed_panel(get_panel(panelists))
+    cross_sizes = dict(zip(crossed_panel.crosses, crossed_panel.cross_sizes.tolist()))
+    key = solution = None
+    if cache is not None:
+        key = cache.key(population, cross_sizes, len(panelists), solver)
+        solution = cache.get(key)
+    if solution is None:
+        model = build_crosses_model(population, cross_sizes, len(panelists))
+        solution = dict(zip(model.crosses, SOLVERS[solver](model, eclipse_bin_path).tolist()))
+        if cache is not None:
+            cache.put(key, solution)
+    return weights_to_dict(*get_panel_weights(crossed_panel, list(solution), list(solution.values())))
+
+
+def run(population_path, panelists_path, output_path, eclipse_bin_path, print_we, solver='eclipse',
+        method='exact', tolerance=1e-9, max_iterations=1000, trim=None, cache=None):
     with open(population_path) as f:
         population = json.load(f)
 
     with open(panelists_path) as f:
         panelists = json.load(f)
 
-    program, all_cross_ids, crosses_population, cross_mapping = generate_program_cmd(population, panelists)
-    eclipse_result = run_eclipse(
-        eclipse_bin=eclipse_bin_path,
-        program_cmd='\n'.join(program),
-        result_cmd='answer({all_ids}).'.format(all_ids=', '.join(all_cross_ids))
-    )
-    crosses = parse_result(eclipse_result)
-    weights = get_weights(crosses, cross_mapping, crosses_population)
+    weights = weight(population, panelists, solver, eclipse_bin_path, method, tolerance, max_iterations, trim, cache)
 
     with open(output_path, 'w') as f:
         json.dump(weights, f, indent=4)
@@ -233,7 +617,15 @@ if __name__ == '__main__':
     parser.add_argument("--population")
     parser.add_argument("--output")
     parser.add_argument("--print-we", action='store_true', default=False)
-    parser.add_argument("--eclipse-bin", default="/opt/eclipse/eclipse_clp/bin/x86_64_linux/eclipse")
+    parser.add_argument("--eclipse-bin", default=ECLIPSE_BIN)
+    parser.add_argument("--solver", choices=sorted(SOLVERS), default='eclipse')
+    parser.add_argument("--method", choices=['exact', 'rake'], default='exact')
+    parser.add_argument("--tolerance", type=float, default=1e-9, help='raking convergence tolerance')
+    parser.add_argument("--max-iterations", type=int, default=1000, help='raking iterations limit')
+    parser.add_argument("--trim", type=float, nargs=2, metavar=('MIN', 'MAX'),
+                        help='raking weight bounds, as multiples of mean weight')
+    parser.add_argument("--cache-dir", help='directory to cache solutions in')
+    parser.add_argument("--cache-size", type=int, default=64, help='cache size limit in MB')
 
     args = parser.parse_args()
     run(
@@ -241,5 +633,11 @@ if __name__ == '__main__':
         population_path=args.population,
         output_path=args.output,
         eclipse_bin_path=args.eclipse_bin,
-        print_we=args.print_we
+        print_we=args.print_we,
+        solver=args.solver,
+        method=args.method,
+        tolerance=args.tolerance,
+        max_iterations=args.max_iterations,
+        trim=args.trim,
+        cache=SolutionCache(args.cache_dir, args.cache_size * 2 ** 20) if args.cache_dir else None
     )
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+"""
+Weights many independent panels listed in a manifest by a pool of worker processes.
+Manifest is a JSON Lines file (or JSON list) of `{"panelists": ..., "population": ..., "output": ...}` objects,
+relative paths are resolved against directory of the manifest.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from multiprocessing import Pool
+
+import weighting
+
+Job = namedtuple('Job', ['panelists', 'population', 'output'])
+JobResult = namedtuple('JobResult', [
+    'panelists', 'output', 'status', 'error', 'parse_time', 'weight_time', 'efficiency'
+])
+
+# populations parsed once by the parent process and options of weighting, shared with workers
+_POPULATIONS = {}
+_OPTIONS = {}
+
+
+def read_manifest(path):
+    with open(path) as f:
+        content = f.read()
+    if content.lstrip().startswith('['):
+        entries = json.loads(content)
+    else:
+        entries = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    base = os.path.dirname(os.path.abspath(path))
+    return [
+        Job(*(os.path.join(base, entry[field]) for field in Job._fields))
+        for entry in entries
+    ]
+
+
+def _describe(error):
+    return '{}: {}'.format(type(error).__name__, error)
+
+
+def load_populations(jobs):
+    """
+    Parses every population file once. Populations which cannot be read are mapped to error message.
+    """
+    populations = {}
+    for job in jobs:
+        if job.population in populations:
+            continue
+        try:
+            with open(job.population) as f:
+                populations[job.population] = json.load(f)
+        except (OSError, ValueError) as e:
+            populations[job.population] = _describe(e)
+    return populations
+
+
+def _init_worker(populations, options):
+    _POPULATIONS.update(populations)
+    _OPTIONS.update(options)
+
+
+def run_job(job):
+    parse_time = weight_time = None
+    start = time.perf_counter()
+    population = _POPULATIONS[job.population]
+    try:
+        if isinstance(population, str):
+            return JobResult(job.panelists, job.output, 'parse_error', population, None, None, None)
+        with open(job.panelists) as f:
+            panelists = json.load(f)
+        parse_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        weights = weighting.weight(population, panelists, **_OPTIONS)
+        weight_time = time.perf_counter() - start
+
+        with open(job.output, 'w') as f:
+            json.dump(weights, f, indent=4)
+    except weighting.WeightingError as e:
+        return JobResult(job.panelists, job.output, 'weighting_error', str(e), parse_time, None, None)
+    except Exception as e:
+        # solver failures (f.e. eclipse exiting with error) are reported like any other error of a single job
+        parse_error = parse_time is None and isinstance(e, (OSError, ValueError, KeyError, TypeError))
+        status = 'parse_error' if parse_error else 'error'
+        return JobResult(job.panelists, job.output, status, _describe(e), parse_time, weight_time, None)
+    return JobResult(
+        job.panelists, job.output, 'ok', None, parse_time, weight_time, weighting.calc_weighting_efficiency(weights)
+    )
+
+
+def run_batch(jobs, processes=None, **options):
+    """
+    Weights all jobs with at most `processes` solvers running at once, options are passed to weighting.weight.
+    Failed jobs do not stop the batch. Returns results in order of jobs.
+    """
+    with Pool(processes, initializer=_init_worker, initargs=(load_populations(jobs), options)) as pool:
+        return pool.map(run_job, jobs, chunksize=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--manifest")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help='maximal number of solvers at once')
+    parser.add_argument("--eclipse-bin", default=weighting.ECLIPSE_BIN)
+    parser.add_argument("--solver", choices=sorted(weighting.SOLVERS), default='eclipse')
+    parser.add_argument("--method", choices=['exact', 'rake'], default='exact')
+    parser.add_argument("--report", help='file to write per job results to, as JSON lines')
+    parser.add_argument("--cache-dir", help='directory to cache solutions in, shared by all workers')
+    parser.add_argument("--cache-size", type=int, default=64, help='cache size limit in MB')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_batch(
+        read_manifest(args.manifest), args.processes,
+        solver=args.solver, eclipse_bin_path=args.eclipse_bin, method=args.method,
+        cache=weighting.SolutionCache(args.cache_dir, args.cache_size * 2 ** 20) if args.cache_dir else None
+    )
+    elapsed = time.perf_counter() - start
+
+    for r in results:
+        if r.status == 'ok':
+            print('{} weighted in {:.2f}s, weighting efficiency {:.2f}'.format(
+                r.panelists, r.parse_time + r.weight_time, r.efficiency
+            ))
+        else:
+            print('{} failed ({}): {}'.format(r.panelists, r.status, r.error))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            for r in results:
+                print(json.dumps(r._asdict()), file=f)
+
+    failed = [r for r in results if r.status != 'ok']
+    print('Weighted {} panels in {:.2f}s with {} processes, {} failed'.format(
+        len(results), elapsed, args.processes, len(failed)
+    ))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+"""
+Measures how weighting scales with panel size, number of demographic features and values per feature.
+Every point of the sweep is run in a fresh process on a synthetic panel, with building the model, solving it
+and spreading weights over panelists timed separately, and peak memory of the process recorded.
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import generate_random_panel
+import weighting
+
+
+def get_panel(size, cardinalities, seed):
+    dimensions = generate_random_panel.random_dimensions(cardinalities, 100 * size, np.random.default_rng(seed))
+    ids, codes, metric = next(generate_random_panel.generate_chunks(size, dimensions, seed, size))
+    panel = weighting.Panel(
+        ids, [dimension.name for dimension in dimensions], [dimension.values for dimension in dimensions],
+        codes, metric
+    )
+    return generate_random_panel.get_population(dimensions, 100 * size), panel
+
+
+def measure(point):
+    size, n_dimensions, n_values, solver, eclipse_bin, seed = point
+    result = {'size': size, 'dimensions': n_dimensions, 'values': n_values, 'solver': solver}
+    population, panel = get_panel(size, [n_values] * n_dimensions, seed)
+    try:
+        start = time.perf_counter()
+        crossed_panel = weighting.get_crossed_panel(panel)
+        model = weighting.build_crosses_model(
+            population, dict(zip(crossed_panel.crosses, crossed_panel.cross_sizes.tolist())), size
+        )
+        result['model'] = time.perf_counter() - start
+        result['crosses'] = model.n_crosses
+
+        start = time.perf_counter()
+        cross_populations = weighting.SOLVERS[solver](model, eclipse_bin)
+        result['solve'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, weights = weighting.get_panel_weights(crossed_panel, model.crosses, cross_populations)
+        result['weights'] = time.perf_counter() - start
+        result['efficiency'] = weighting.calc_weighting_efficiency(weights)
+    except weighting.WeightingError as e:
+        result['error'] = str(e)
+    result['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def get_solvers(solvers, eclipse_bin):
+    if 'eclipse' in solvers and not (os.path.exists(eclipse_bin) or shutil.which(eclipse_bin)):
+        print('Skipping eclipse solver, {} not found'.format(eclipse_bin))
+        return [solver for solver in solvers if solver != 'eclipse']
+    return solvers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs='*', default=[1000, 10000, 100000])
+    parser.add_argument("--dimensions", type=int, nargs='*', default=[2, 3, 4])
+    parser.add_argument("--values", type=int, nargs='*', default=[3, 5])
+    parser.add_argument("--solvers", nargs='*', choices=sorted(weighting.SOLVERS), default=sorted(weighting.SOLVERS))
+    parser.add_argument("--eclipse-bin", default=weighting.ECLIPSE_BIN)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help='file to write results to, as JSON lines')
+    parser.add_argument("--label", help='label of measured version, saved with every result')
+    args = parser.parse_args()
+
+    points = [
+        (size, n_dimensions, n_values, solver, args.eclipse_bin, args.seed)
+        for solver, size, n_dimensions, n_values in itertools.product(
+            get_solvers(args.solvers, args.eclipse_bin), args.sizes, args.dimensions, args.values
+        )
+    ]
+
+    results = []
+    # every point runs in a new process, so peak memory is measured for that point only
+    with Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(measure, points):
+            results.append(dict(result, label=args.label, seed=args.seed))
+            if 'error' in result:
+                print('{solver} {size} panelists, {dimensions}x{values}: {error}'.format(**result))
+                continue
+            print(
+                '{solver} {size} panelists, {dimensions}x{values} ({crosses} crosses): model {model:.3f}s, '
+                'solve {solve:.3f}s, weights {weights:.3f}s, efficiency {efficiency:.1f}, '
+                'peak memory {max_rss_kb}kB'.format(**result)
+            )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            for result in results:
+                print(json.dumps(result), file=f)
@@ -1,71 +1,142 @@
-from typing import TypeVar, List, Tuple, Dict, Optional
-import z3
+import time
+from typing import Any, TypeVar, List, Tuple, Dict, NamedTuple, Optional, Set
 
+from coloring.cnf import CNF, Solver
+from coloring.graph import adjacency, greedy_clique
+from coloring.heuristic import ArrayGraph, dsatur, heuristic_coloring
 
-def model(phi):
-    s = z3.Solver()
-    s.add(phi)
-    return s.model() if s.check() == z3.sat else None
+# seconds for heuristic coloring, before the formula is built
+HEURISTIC_TIMEOUT = 1.0
 
 
-def color_var(color_num: int, vertex_num: int) -> z3.Bool:
-    return z3.Bool('C_{color}_{vertex}'.format(color=color_num, vertex=vertex_num))
+def encode_coloring(cnf: CNF, num_of_vertices: int, edges: List[Tuple[int, int]], num_of_colors: int) -> List[List[int]]:
+    colors: List[List[int]] = [cnf.new_vars(num_of_colors) for _ in range(num_of_vertices)]
+    for vertex_colors in colors:
+        cnf.exactly_one(vertex_colors)
+
+    for (i1, i2) in edges:
+        for color1, color2 in zip(colors[i1], colors[i2]):
+            cnf.add_clause([-color1, -color2])
+    return colors
+
+
+def break_symmetries(cnf: CNF, colors: List[List[int]], neighbours: List[Set[int]], clique: List[int]) -> None:
+    """
+    Colors are interchangeable, so vertices of the clique get colors 0, 1, ... in order, and every next color
+    can be used by a vertex only when the previous one is used by an earlier vertex (value precedence).
+    Other vertices are ordered by degree.
+    """
+    for color, v in enumerate(clique):
+        cnf.add_clause([colors[v][color]])
+
+    in_clique = set(clique)
+    order = sorted((v for v in range(len(colors)) if v not in in_clique), key=lambda v: -len(neighbours[v]))
+    used_before: List[Optional[int]] = [None] * len(colors[0]) if colors else []
+    for v in order:
+        for color in range(len(clique) + 1, len(used_before)):
+            previous = used_before[color - 1]
+            cnf.add_clause([-colors[v][color]] + ([previous] if previous is not None else []))
+        # used[color] is true when color is used by v or an earlier vertex
+        used = [None] * len(used_before)
+        for color in range(len(clique), len(used_before) - 1):
+            used[color] = cnf.new_vars(1)[0]
+            cnf.add_clause([-colors[v][color], used[color]])
+            if used_before[color] is None:
+                cnf.add_clause([-used[color], colors[v][color]])
+            else:
+                cnf.add_clause([-used[color], colors[v][color], used_before[color]])
+                cnf.add_clause([-used_before[color], used[color]])
+        used_before = used
+
+
+def decode_coloring(solver: Solver, colors: List[List[int]]) -> List[int]:
+    values = solver.values([var for vertex_colors in colors for var in vertex_colors])
+    num_of_colors = len(colors[0]) if colors else 0
+    return [values[i * num_of_colors:(i + 1) * num_of_colors].index(True) for i in range(len(colors))]
 
 
 T = TypeVar('T')
 
 
-def graph_coloring(vertices: List[T], edges: List[Tuple[T, T]], num_of_colors: int) -> Optional[Dict[T, int]]:
-    program: List[str] = []
-    v_number: Dict[T, int] = {}
-    colors: List[int] = list(range(0, num_of_colors))
-    for i, v in enumerate(vertices):
-        v_number[v] = i
-        at_least_one = []
-        for color in colors:
-            at_least_one.append(
-                color_var(color, i)
-            )
-        program.append(z3.Or(at_least_one))
-
-        pairwise = []
-        for (idx, color1) in enumerate(colors):
-            for color2 in colors[idx + 1:]:
-                pairwise.append(
-                    z3.Not(
-                        z3.And(
-                            color_var(color1, i),
-                            color_var(color2, i)
-                        )
-                    )
-                )
-        program.append(z3.And(pairwise))
-
-    for (v1, v2) in edges:
-        i1 = v_number[v1]
-        i2 = v_number[v2]
-        for color in colors:
-            program.append(
-                z3.Not(
-                    z3.And(
-                        color_var(color, i1),
-                        color_var(color, i2)
-                    )
-                )
-            )
-
-    program.append(color_var(0, 0))
-
-    res = model(z3.And(program))
-
-    if res is None:
+def graph_coloring(vertices: List[T], edges: List[Tuple[T, T]], num_of_colors: int,
+                   heuristic_timeout: float = HEURISTIC_TIMEOUT) -> Optional[Dict[T, int]]:
+    """
+    Heuristic coloring is tried first, the formula is solved only when it does not find a coloring
+    within heuristic_timeout seconds.
+    """
+    # adjacency ignores loops, which no coloring can satisfy
+    if any(v1 == v2 for (v1, v2) in edges):
+        return None
+
+    v_number: Dict[T, int] = {v: i for i, v in enumerate(vertices)}
+    numbered_edges = [(v_number[v1], v_number[v2]) for (v1, v2) in edges]
+    neighbours = adjacency(len(vertices), numbered_edges)
+    clique = greedy_clique(neighbours)
+    if len(clique) > num_of_colors:
+        return None
+
+    assignment, conflicts = heuristic_coloring(ArrayGraph(neighbours), num_of_colors, heuristic_timeout)
+    if not conflicts:
+        return dict(zip(vertices, assignment))
+
+    cnf = CNF()
+    colors = encode_coloring(cnf, len(vertices), numbered_edges, num_of_colors)
+    break_symmetries(cnf, colors, neighbours, clique)
+
+    solver = Solver(cnf)
+    if not solver.check():
         return None
+    return dict(zip(vertices, decode_coloring(solver, colors)))
+
+
+class ChromaticNumber(NamedTuple):
+    num_of_colors: int
+    coloring: Dict[Any, int]
+    # False when time budget ran out before the number of colors was proven minimal
+    optimal: bool
+
+
+def chromatic_number(vertices: List[T], edges: List[Tuple[T, T]], timeout: Optional[float] = None) -> ChromaticNumber:
+    """
+    Starts from DSatur coloring and asks for colorings with fewer and fewer colors, until the solver proves
+    there is none or the size of a clique is reached. All questions go to one solver: the formula is built
+    once for one color less than DSatur needs, and colors above current bound are disabled by assumptions,
+    so clauses learned for one bound are reused for the next ones. With timeout (in seconds) the best
+    coloring found so far is returned. Graphs with loops have no coloring, ValueError is raised for them.
+    """
+    if any(v1 == v2 for (v1, v2) in edges):
+        raise ValueError('Graph with a loop has no coloring')
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    v_number: Dict[T, int] = {v: i for i, v in enumerate(vertices)}
+    numbered_edges = [(v_number[v1], v_number[v2]) for (v1, v2) in edges]
+    neighbours = adjacency(len(vertices), numbered_edges)
+    clique = greedy_clique(neighbours)
+    best = dsatur(ArrayGraph(neighbours))
+    upper = max(best, default=-1) + 1
+    lower = len(clique)
+
+    if upper > lower:
+        cnf = CNF()
+        colors = encode_coloring(cnf, len(vertices), numbered_edges, upper - 1)
+        enabled = cnf.new_vars(upper - 1)
+        for vertex_colors in colors:
+            for var, color_enabled in zip(vertex_colors, enabled):
+                cnf.add_clause([-var, color_enabled])
+        break_symmetries(cnf, colors, neighbours, clique)
+        solver = Solver(cnf)
 
-    color_map = {}
-    for var in map(str, res):
-        if var.startswith('C_'):
-            if res[z3.Bool(var)]:
-                _, color, vertex_idx = var.split('_')
-                color_map[vertices[int(vertex_idx)]] = int(color)
+        while upper > lower:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            result = solver.check([-color_enabled for color_enabled in enabled[upper - 1:]], remaining)
+            if result is None:
+                break
+            if not result:
+                lower = upper
+                continue
+            best = decode_coloring(solver, colors)
+            upper = max(best) + 1
 
-    return color_map
+    return ChromaticNumber(upper, dict(zip(vertices, best)), upper == lower)
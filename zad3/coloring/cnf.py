@@ -0,0 +1,98 @@
+from typing import Dict, List, Optional, Sequence
+
+import z3
+
+
+class CNF:
+    """
+    Clauses over integer variables, DIMACS style: variable is a positive number, its negation is a negative one.
+    """
+
+    def __init__(self) -> None:
+        self.num_vars = 0
+        self.clauses: List[List[int]] = []
+
+    def new_vars(self, count: int) -> List[int]:
+        first = self.num_vars + 1
+        self.num_vars += count
+        return list(range(first, self.num_vars + 1))
+
+    def add_clause(self, literals: Sequence[int]) -> None:
+        self.clauses.append(list(literals))
+
+    def at_most_one(self, literals: Sequence[int]) -> None:
+        """
+        Sequential counter encoding (Sinz 2005): n - 1 auxiliary variables and 3n - 4 clauses,
+        auxiliary variable s_j is true when one of literals 0..j is true.
+        """
+        if len(literals) < 2:
+            return
+        s = self.new_vars(len(literals) - 1)
+        self.add_clause([-literals[0], s[0]])
+        for j in range(1, len(literals) - 1):
+            self.add_clause([-literals[j], s[j]])
+            self.add_clause([-s[j - 1], s[j]])
+            self.add_clause([-literals[j], -s[j - 1]])
+        self.add_clause([-literals[-1], -s[-1]])
+
+    def exactly_one(self, literals: Sequence[int]) -> None:
+        self.add_clause(literals)
+        self.at_most_one(literals)
+
+
+def _name(var: int) -> str:
+    return 'x{}'.format(var)
+
+
+def _literal(literal: int) -> str:
+    return _name(literal) if literal > 0 else '(not {})'.format(_name(-literal))
+
+
+def _clause(clause: List[int]) -> str:
+    return '(assert (or {}))'.format(' '.join(map(_literal, clause))) if clause else '(assert false)'
+
+
+class Solver:
+    """
+    z3 solver fed with clauses of CNF. Clauses added since the previous check are passed to z3 at once,
+    as SMT-LIB2 text parsed on z3 side, so no z3 expression is built in Python for them.
+    """
+
+    def __init__(self, cnf: CNF) -> None:
+        self.cnf = cnf
+        self.solver = z3.Solver()
+        self._declared = 0
+        self._fed = 0
+
+    def variable(self, var: int) -> z3.BoolRef:
+        return z3.Bool(_name(var))
+
+    def literal(self, literal: int) -> z3.BoolRef:
+        return self.variable(literal) if literal > 0 else z3.Not(self.variable(-literal))
+
+    def feed(self) -> None:
+        program = [
+            '(declare-const {} Bool)'.format(_name(var)) for var in range(self._declared + 1, self.cnf.num_vars + 1)
+        ]
+        program.extend(map(_clause, self.cnf.clauses[self._fed:]))
+        if program:
+            self.solver.from_string(''.join(program))
+        self._declared = self.cnf.num_vars
+        self._fed = len(self.cnf.clauses)
+
+    def check(self, assumptions: Sequence[int] = (), timeout: Optional[float] = None) -> Optional[bool]:
+        """
+        Returns None when z3 gives up, f.e. when timeout (in seconds) passes.
+        """
+        self.feed()
+        if timeout is not None:
+            self.solver.set('timeout', max(1, int(timeout * 1000)))
+        result = self.solver.check(*map(self.literal, assumptions))
+        if result == z3.unknown:
+            return None
+        return result == z3.sat
+
+    def values(self, variables: Sequence[int]) -> List[bool]:
+        model = self.solver.model()
+        model_values: Dict[str, bool] = {decl.name(): z3.is_true(model[decl]) for decl in model.decls()}
+        return [model_values.get(_name(var), False) for var in variables]
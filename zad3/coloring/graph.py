@@ -0,0 +1,34 @@
+from typing import List, Set, Tuple
+
+MAX_CLIQUE_STARTS = 64
+
+
+def adjacency(num_of_vertices: int, edges: List[Tuple[int, int]]) -> List[Set[int]]:
+    neighbours: List[Set[int]] = [set() for _ in range(num_of_vertices)]
+    for (i1, i2) in edges:
+        if i1 != i2:
+            neighbours[i1].add(i2)
+            neighbours[i2].add(i1)
+    return neighbours
+
+
+def greedy_clique(neighbours: List[Set[int]]) -> List[int]:
+    """
+    Grows a clique from each of the highest degree vertices, always adding the candidate with the most
+    neighbours among the remaining candidates. Returns the largest clique found.
+    """
+    starts = sorted(range(len(neighbours)), key=lambda v: -len(neighbours[v]))[:MAX_CLIQUE_STARTS]
+    best: List[int] = []
+    for start in starts:
+        if len(neighbours[start]) < len(best):
+            break
+        clique = [start]
+        candidates = set(neighbours[start])
+        while candidates:
+            v = max(candidates, key=lambda u: (len(neighbours[u] & candidates), -u))
+            clique.append(v)
+            candidates &= neighbours[v]
+        if len(clique) > len(best):
+            best = clique
+    return best
+
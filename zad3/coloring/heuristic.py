@@ -0,0 +1,141 @@
+import heapq
+import random
+import time
+from array import array
+from typing import List, Sequence, Set, Tuple
+
+# tabu tenure of a move is random part below TABU_TENURE plus TABU_CONFLICT_FACTOR * number of conflicting vertices
+TABU_TENURE = 10
+TABU_CONFLICT_FACTOR = 0.6
+
+
+class ArrayGraph:
+    """
+    Adjacency lists of all vertices stored one after another in a single array (CSR style),
+    neighbours of v are targets[offsets[v]:offsets[v + 1]].
+    """
+
+    def __init__(self, neighbours: List[Set[int]]) -> None:
+        self.offsets = array('l', [0])
+        self.targets = array('l')
+        for vertex_neighbours in neighbours:
+            self.targets.extend(sorted(vertex_neighbours))
+            self.offsets.append(len(self.targets))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def degree(self, v: int) -> int:
+        return self.offsets[v + 1] - self.offsets[v]
+
+    def neighbours(self, v: int) -> Sequence[int]:
+        return self.targets[self.offsets[v]:self.offsets[v + 1]]
+
+
+def dsatur(graph: ArrayGraph) -> List[int]:
+    """
+    Greedy coloring (Brelaz 1979): next vertex is the one with the most distinct colors among its neighbours,
+    ties broken by degree. It gets the smallest color not used by its neighbours.
+    """
+    colors = [-1] * len(graph)
+    neighbour_colors: List[Set[int]] = [set() for _ in range(len(graph))]
+    heap = [(0, -graph.degree(v), v) for v in range(len(graph))]
+    heapq.heapify(heap)
+    while heap:
+        saturation, _, v = heapq.heappop(heap)
+        # entries are not removed when saturation grows, a newer entry is pushed instead
+        if colors[v] >= 0 or -saturation != len(neighbour_colors[v]):
+            continue
+        color = 0
+        while color in neighbour_colors[v]:
+            color += 1
+        colors[v] = color
+        for u in graph.neighbours(v):
+            if colors[u] < 0 and color not in neighbour_colors[u]:
+                neighbour_colors[u].add(color)
+                heapq.heappush(heap, (-len(neighbour_colors[u]), -graph.degree(u), u))
+    return colors
+
+
+def tabucol(graph: ArrayGraph, num_of_colors: int, colors: List[int], deadline: float,
+            rng: random.Random) -> Tuple[List[int], int]:
+    """
+    Tabu search (Hertz, de Werra 1987) over assignments of num_of_colors colors, minimizing the number of edges
+    with both ends of the same color. Every step moves a conflicting vertex to the color decreasing the number
+    of conflicts the most, moving it back to its previous color is forbidden for some steps.
+    Stops at a proper coloring or at deadline, returns the best assignment found and its number of conflicts.
+    """
+    k = num_of_colors
+    colors = list(colors)
+    # gamma[v * k + c] is the number of neighbours of v colored c
+    gamma = array('l', [0]) * (len(graph) * k)
+    for v in range(len(graph)):
+        for u in graph.neighbours(v):
+            gamma[v * k + colors[u]] += 1
+    conflicting = {v for v in range(len(graph)) if gamma[v * k + colors[v]]}
+    conflicts = sum(gamma[v * k + colors[v]] for v in conflicting) // 2
+    # tabu[v * k + c] is the last step in which v cannot be moved to c
+    tabu = array('l', [0]) * (len(graph) * k)
+    best, best_conflicts = list(colors), conflicts
+
+    step = 0
+    while conflicts and time.monotonic() < deadline:
+        step += 1
+        best_delta, moves = 0, []
+        for v in conflicting:
+            current = gamma[v * k + colors[v]]
+            for color in range(k):
+                if color == colors[v]:
+                    continue
+                delta = gamma[v * k + color] - current
+                # tabu moves are allowed only when they lead to the best assignment so far
+                if tabu[v * k + color] >= step and conflicts + delta >= best_conflicts:
+                    continue
+                if not moves or delta < best_delta:
+                    best_delta, moves = delta, [(v, color)]
+                elif delta == best_delta:
+                    moves.append((v, color))
+        if not moves:
+            continue
+
+        v, color = rng.choice(moves)
+        previous = colors[v]
+        tabu[v * k + previous] = step + rng.randrange(TABU_TENURE) + int(TABU_CONFLICT_FACTOR * len(conflicting))
+        colors[v] = color
+        conflicts += best_delta
+        for u in graph.neighbours(v):
+            gamma[u * k + previous] -= 1
+            gamma[u * k + color] += 1
+            if colors[u] == previous and not gamma[u * k + previous]:
+                conflicting.discard(u)
+            elif colors[u] == color:
+                conflicting.add(u)
+        if gamma[v * k + color]:
+            conflicting.add(v)
+        else:
+            conflicting.discard(v)
+
+        if conflicts < best_conflicts:
+            best, best_conflicts = list(colors), conflicts
+    return best, best_conflicts
+
+
+def heuristic_coloring(graph: ArrayGraph, num_of_colors: int, timeout: float, seed: int = 0) -> Tuple[List[int], int]:
+    """
+    DSatur coloring, if it needs more than num_of_colors colors, vertices of extra colors get their least
+    conflicting color and tabu search repairs the assignment within timeout (in seconds).
+    Returns assignment of colors below num_of_colors and its number of conflicting edges (0 for proper coloring).
+    """
+    deadline = time.monotonic() + timeout
+    colors = dsatur(graph)
+    if max(colors, default=-1) < num_of_colors:
+        return colors, 0
+
+    for v, color in enumerate(colors):
+        if color >= num_of_colors:
+            counts = [0] * num_of_colors
+            for u in graph.neighbours(v):
+                if colors[u] < num_of_colors:
+                    counts[colors[u]] += 1
+            colors[v] = counts.index(min(counts))
+    return tabucol(graph, num_of_colors, colors, deadline, random.Random(seed))
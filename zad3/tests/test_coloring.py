@@ -1,30 +1,36 @@
+import itertools
 import os
 from typing import List, Tuple, Dict
 from unittest import TestCase
 
-from coloring import graph_coloring
+from coloring import chromatic_number, graph_coloring
+from coloring.cnf import CNF, Solver
+from coloring.graph import adjacency, greedy_clique
+from coloring.heuristic import ArrayGraph, dsatur, heuristic_coloring
 
 
-class ColoringTest(TestCase):
-    TEST_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input_data')
+TEST_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input_data')
 
-    def _read_file(self, filename: str) -> Tuple[List[int], List[Tuple[int, int]]]:
-        edges = []
-        with open(os.path.join(self.TEST_DATA_PATH, filename)) as f:
-            for line in f:
-                line = line.rstrip('\n')
-                elems = line.split(' ')
-                if elems[0] == 'c':
-                    continue
-                if elems[0] == 'p':
-                    number_of_vertices = int(elems[2])
-                    number_of_edges = int(elems[3])
 
-                if elems[0] == 'e':
-                    edges.append((int(elems[1]), int(elems[2])))
-        vertices = list(range(1, number_of_vertices + 1))
-        return vertices, edges
+def read_file(filename: str) -> Tuple[List[int], List[Tuple[int, int]]]:
+    edges = []
+    with open(os.path.join(TEST_DATA_PATH, filename)) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            elems = line.split(' ')
+            if elems[0] == 'c':
+                continue
+            if elems[0] == 'p':
+                number_of_vertices = int(elems[2])
+                number_of_edges = int(elems[3])
 
+            if elems[0] == 'e':
+                edges.append((int(elems[1]), int(elems[2])))
+    vertices = list(range(1, number_of_vertices + 1))
+    return vertices, edges
+
+
+class ColoringTestCase(TestCase):
     def _test_coloring(self, coloring: Dict[int, int], edges: List[Tuple[int, int]], num_of_colors: int = 3) -> None:
         for (v1, v2) in edges:
             color = coloring[v1]
@@ -32,8 +38,10 @@ class ColoringTest(TestCase):
             self.assertNotEqual(color, neigh_color)
         self.assertLessEqual(len(set(coloring.values())), num_of_colors)
 
+
+class ColoringTest(ColoringTestCase):
     def _run_on_file(self, filename: str, num_of_colors: int = 3) -> None:
-        vertices, edges = self._read_file(filename)
+        vertices, edges = read_file(filename)
         colors = graph_coloring(
             vertices=vertices,
             edges=edges,
@@ -52,6 +60,32 @@ class ColoringTest(TestCase):
         )
         self._test_coloring(res, edges, num_of_colors)
 
+    def test_unsatisfiable(self):
+        res = graph_coloring(
+            vertices=[1, 2, 3],
+            edges=[(1, 2), (2, 3), (1, 3)],
+            num_of_colors=2
+        )
+        self.assertIsNone(res)
+
+    def test_loop(self):
+        for heuristic_timeout in [0.0, 1.0]:
+            res = graph_coloring(
+                vertices=[1, 2],
+                edges=[(1, 1), (1, 2)],
+                num_of_colors=2,
+                heuristic_timeout=heuristic_timeout
+            )
+            self.assertIsNone(res)
+
+    def test_clique_larger_than_colors(self):
+        vertices, edges = read_file('queen8_8.col')
+        self.assertIsNone(graph_coloring(vertices=vertices, edges=edges, num_of_colors=7))
+
+    def test_queen8_8_unsatisfiable(self):
+        vertices, edges = read_file('queen8_8.col')
+        self.assertIsNone(graph_coloring(vertices=vertices, edges=edges, num_of_colors=8))
+
     def test_games(self):
         self._run_on_file('games120.col', 9)
 
@@ -72,3 +106,119 @@ class ColoringTest(TestCase):
 
     def test_queen8_12(self):
         self._run_on_file('queen5_5.col', 5)
+
+
+class SatColoringTest(ColoringTestCase):
+    def test_queen8_12(self):
+        # DSatur needs 14 colors and tabu search gets no time, so the coloring comes from z3
+        vertices, edges = read_file('queen8_12.col')
+        colors = graph_coloring(vertices=vertices, edges=edges, num_of_colors=12, heuristic_timeout=0.0)
+        self.assertIsNotNone(colors)
+        self._test_coloring(colors, edges, 12)
+
+
+class ChromaticNumberTest(ColoringTestCase):
+    def _run_on_file(self, filename: str, num_of_colors: int) -> None:
+        vertices, edges = read_file(filename)
+        result = chromatic_number(vertices=vertices, edges=edges)
+        self.assertEqual(result.num_of_colors, num_of_colors)
+        self.assertTrue(result.optimal)
+        self.assertEqual(set(result.coloring), set(vertices))
+        self._test_coloring(result.coloring, edges, num_of_colors)
+
+    def test_basic(self):
+        edges = [(1, 2), (2, 3)]
+        result = chromatic_number(vertices=[1, 2, 3], edges=edges)
+        self.assertEqual(result.num_of_colors, 2)
+        self.assertTrue(result.optimal)
+        self._test_coloring(result.coloring, edges, 2)
+
+    def test_empty(self):
+        self.assertEqual(chromatic_number(vertices=[], edges=[]), (0, {}, True))
+
+    def test_games(self):
+        self._run_on_file('games120.col', 9)
+
+    def test_miles250(self):
+        self._run_on_file('miles250.col', 8)
+
+    def test_myciel3(self):
+        self._run_on_file('myciel3.col', 4)
+
+    def test_myciel4(self):
+        self._run_on_file('myciel4.col', 5)
+
+    def test_queen5_5(self):
+        self._run_on_file('queen5_5.col', 5)
+
+    def test_queen8_12(self):
+        self._run_on_file('queen8_12.col', 12)
+
+    def test_loop(self):
+        with self.assertRaises(ValueError):
+            chromatic_number(vertices=[1, 2], edges=[(1, 1), (1, 2)])
+
+    def test_timeout(self):
+        vertices, edges = read_file('myciel4.col')
+        result = chromatic_number(vertices=vertices, edges=edges, timeout=0)
+        self.assertFalse(result.optimal)
+        self._test_coloring(result.coloring, edges, result.num_of_colors)
+
+
+class CNFTest(TestCase):
+    def test_exactly_one(self):
+        for n in range(1, 6):
+            for assignment in itertools.product([False, True], repeat=n):
+                cnf = CNF()
+                literals = cnf.new_vars(n)
+                cnf.exactly_one(literals)
+                solver = Solver(cnf)
+                expected = sum(assignment) == 1
+                self.assertEqual(
+                    solver.check([var if value else -var for var, value in zip(literals, assignment)]), expected
+                )
+
+
+class GraphTest(TestCase):
+    def test_greedy_clique(self):
+        vertices, edges = read_file('queen8_8.col')
+        neighbours = adjacency(len(vertices) + 1, edges)
+        clique = greedy_clique(neighbours)
+        self.assertEqual(len(clique), 8)
+        for v1, v2 in itertools.combinations(clique, 2):
+            self.assertIn(v2, neighbours[v1])
+
+    def test_dsatur(self):
+        vertices, edges = read_file('myciel4.col')
+        colors = dsatur(ArrayGraph(adjacency(len(vertices) + 1, edges)))
+        for v1, v2 in edges:
+            self.assertNotEqual(colors[v1], colors[v2])
+
+
+class HeuristicTest(TestCase):
+    def _graph(self, filename: str) -> Tuple[ArrayGraph, List[Tuple[int, int]]]:
+        vertices, edges = read_file(filename)
+        return ArrayGraph(adjacency(len(vertices) + 1, edges)), edges
+
+    def test_array_graph(self):
+        neighbours = adjacency(4, [(0, 1), (2, 1), (1, 3)])
+        graph = ArrayGraph(neighbours)
+        self.assertEqual(len(graph), 4)
+        self.assertEqual([list(graph.neighbours(v)) for v in range(4)], [[1], [0, 2, 3], [1], [1]])
+        self.assertEqual(graph.degree(1), 3)
+
+    def test_tabu_search(self):
+        for filename, num_of_colors in [('queen5_5.col', 5), ('queen8_12.col', 12), ('miles250.col', 8)]:
+            graph, edges = self._graph(filename)
+            colors, conflicts = heuristic_coloring(graph, num_of_colors, timeout=5.0)
+            self.assertEqual(conflicts, 0)
+            self.assertLess(max(colors), num_of_colors)
+            for v1, v2 in edges:
+                self.assertNotEqual(colors[v1], colors[v2])
+
+    def test_conflicts(self):
+        graph, edges = self._graph('myciel4.col')
+        colors, conflicts = heuristic_coloring(graph, 4, timeout=0.1)
+        self.assertGreater(conflicts, 0)
+        self.assertLess(max(colors), 4)
+        self.assertEqual(conflicts, sum(colors[v1] == colors[v2] for v1, v2 in edges))